@@ -1,8 +1,24 @@
 import anthropic
+import argparse
+import ast
+import asyncio
+import hashlib
+import httpx
 import importlib.util
+import json
 import os
+import random
+import re
+import signal
+import sqlite3
+import sys
 import tempfile
-from datetime import time
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from dataclasses import dataclass
 from dotenv import load_dotenv
 from pathlib import Path
 from git import Repo
@@ -10,10 +26,1179 @@ from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
 
 load_dotenv()
 
+
+@dataclass
+class GenerationResult:
+    """Outcome of generating tests for a single module"""
+    source_file: Path
+    test_file: Path = None
+    error: Exception = None
+    estimated_tokens: int = None  # Input cost estimate used for scheduling
+    time_to_first_token: float = None  # Streaming mode only
+    tokens_per_second: float = None  # Streaming mode only
+    skipped: str = None  # Why it wasn't dispatched: 'deadline', 'budget' or 'cancelled'
+    source_hash: str = None  # Hash of the source the tests were generated from
+    cached: bool = False  # Served from the response cache without calling the API
+
+
+class StreamingTestWriter:
+    """Appends streamed test code to a partial file and renames it into place once the response is complete"""
+
+    def __init__(self, test_file, validate=None):
+        self.test_file = test_file
+        self.partial_file = test_file.with_name(test_file.name + '.partial')
+        self.validate = validate  # Called with the completed text; returns the text to keep, or raises to abort
+        self.time_to_first_token = None
+        self.tokens_per_second = None
+        self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.commit()
+            except BaseException:
+                self.abort()
+                raise
+        else:
+            self.abort()
+
+    def reset(self):
+        """Start a new attempt, discarding any text from a failed one"""
+        if self._handle is None:
+            self._handle = open(self.partial_file, 'w')
+        self._handle.seek(0)
+        self._handle.truncate()
+        self._started = time.monotonic()
+        self._first_token_at = None
+        self._pending = ''  # Trailing whitespace is held back so the file ends up stripped like the non-streaming path
+
+    def write(self, text):
+        if self._first_token_at is None:
+            text = text.lstrip()
+            if not text:
+                return
+            self._first_token_at = time.monotonic()
+            self.time_to_first_token = self._first_token_at - self._started
+        text = self._pending + text
+        stripped = text.rstrip()
+        self._pending = text[len(stripped):]
+        self._handle.write(stripped)
+        self._handle.flush()
+
+    def finish(self, output_tokens):
+        """Record throughput once the final token count is known"""
+        if self._first_token_at is not None:
+            elapsed = time.monotonic() - self._first_token_at
+            self.tokens_per_second = output_tokens / elapsed if elapsed > 0 else None
+
+    def commit(self):
+        """Validate the completed file, then atomically replace test_<module>.py with it"""
+        self._handle.flush()
+        if self.validate is not None:
+            text = self.partial_file.read_text()
+            validated = self.validate(text)
+            if validated != text:
+                self._handle.seek(0)
+                self._handle.truncate()
+                self._handle.write(validated)
+                self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.close()
+        os.replace(self.partial_file, self.test_file)
+
+    def abort(self):
+        """Drop the partial file so a failed generation never leaves half a test file behind"""
+        if self._handle is not None:
+            self._handle.close()
+        if self.partial_file.exists():
+            self.partial_file.unlink()
+
+
+class RunJournal:
+    """Append-only log of each module's outcome, so a crashed or interrupted run can be resumed"""
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def replay(self):
+        """Latest entry per source file; a line torn by a crash is ignored"""
+        entries = {}
+        if not self.path.exists():
+            return entries
+        with open(self.path) as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries[entry['source']] = entry
+        return entries
+
+    def record(self, **entry):
+        """Append one entry; a single buffered write per module, fsynced only on close"""
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if self._handle is None:
+                self._handle = open(self.path, 'a')
+            self._handle.write(line)
+            self._handle.flush()  # Survives a crash of this process, if not of the machine
+
+    def close(self, remove=False):
+        """Close the journal, deleting it once the run it describes has completed"""
+        with self._lock:
+            if self._handle is not None:
+                os.fsync(self._handle.fileno())
+                self._handle.close()
+                self._handle = None
+            if remove and self.path.exists():
+                self.path.unlink()
+
+
+@dataclass
+class PipelineJob:
+    """A module moving through the generation pipeline"""
+    result: GenerationResult
+    repo: "GitHubTestGenerator"  # The repository the module belongs to
+    test_dir: Path
+    prompt: str = None
+    test_code: str = None
+    source_code: str = None  # Kept for per-symbol generation, which builds its own prompts
+    fresh: bool = False  # The response came from Claude, so it's cached once it validates
+
+
+class StageStats:
+    """Throughput and queue depth counters for one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.inbox = None
+        self._started = None
+        self._finished = None
+
+    @property
+    def queue_depth(self):
+        """Items currently waiting for this stage"""
+        return self.inbox.qsize() if self.inbox is not None else 0
+
+    def start(self):
+        self._started = time.monotonic()
+
+    def finish(self):
+        self._finished = time.monotonic()
+
+    def observe_queue(self):
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def throughput(self):
+        """Items per second over the stage's lifetime"""
+        if self._started is None:
+            return 0.0
+        elapsed = (self._finished or time.monotonic()) - self._started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+
+def estimate_tokens(text):
+    """Rough token count for rate limiting (about four characters per token); also takes a prompt's content blocks"""
+    if isinstance(text, list):
+        return sum(estimate_tokens(block['text']) for block in text)
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """Token buckets for requests, input tokens and output tokens per minute, shared by all workers"""
+
+    def __init__(self, requests_per_minute=None, input_tokens_per_minute=None, output_tokens_per_minute=None):
+        # Each bucket is [capacity per minute, tokens currently available]; None means unlimited
+        self._buckets = {
+            name: [limit, float(limit)]
+            for name, limit in (
+                ('requests', requests_per_minute),
+                ('input_tokens', input_tokens_per_minute),
+                ('output_tokens', output_tokens_per_minute),
+            )
+            if limit
+        }
+        self._lock = threading.Lock()
+        self._last_refill = time.monotonic()
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        for bucket in self._buckets.values():
+            bucket[1] = min(bucket[0], bucket[1] + elapsed * bucket[0] / 60.0)
+
+    def _reserve(self, cost):
+        """Take cost from every bucket, or return the seconds to wait until all of them can cover it"""
+        with self._lock:
+            self._refill()
+            delay = 0.0
+            for name, (capacity, available) in self._buckets.items():
+                # A single request larger than the bucket only has to wait for a full bucket
+                needed = min(cost[name], capacity)
+                if available < needed:
+                    delay = max(delay, (needed - available) * 60.0 / capacity)
+            if delay == 0.0:
+                for name, bucket in self._buckets.items():
+                    bucket[1] -= min(cost[name], bucket[0])
+            return delay
+
+    def _record_wait(self, waited):
+        with self._lock:
+            self.requests += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def acquire(self, input_tokens, output_tokens):
+        """Block until the request fits in every budget"""
+        cost = {'requests': 1, 'input_tokens': input_tokens, 'output_tokens': output_tokens}
+        start = time.monotonic()
+        delay = self._reserve(cost)
+        while delay > 0:
+            time.sleep(delay)
+            delay = self._reserve(cost)
+        self._record_wait(time.monotonic() - start)
+
+    def try_acquire(self, input_tokens, output_tokens):
+        """Take budget only if it is available right now"""
+        return self._reserve({'requests': 1, 'input_tokens': input_tokens, 'output_tokens': output_tokens}) == 0.0
+
+    async def acquire_async(self, input_tokens, output_tokens):
+        """Wait without blocking the event loop until the request fits in every budget"""
+        cost = {'requests': 1, 'input_tokens': input_tokens, 'output_tokens': output_tokens}
+        start = time.monotonic()
+        delay = self._reserve(cost)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._reserve(cost)
+        self._record_wait(time.monotonic() - start)
+
+    def refund(self, output_tokens):
+        """Return the unused part of a max_tokens reservation to the output budget"""
+        with self._lock:
+            bucket = self._buckets.get('output_tokens')
+            if bucket and output_tokens > 0:
+                bucket[1] = min(bucket[0], bucket[1] + output_tokens)
+
+    def headroom(self):
+        """Fraction of the tightest budget available right now; 1.0 when unlimited"""
+        with self._lock:
+            self._refill()
+            return min((available / capacity for capacity, available in self._buckets.values()), default=1.0)
+
+    def stats(self):
+        """Wait times so the configured limits can be sized"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'total_wait': self.total_wait,
+                'mean_wait': self.total_wait / self.requests if self.requests else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+
+class ApiKey:
+    """One key in an ApiKeyPool, with its own rate limits and health"""
+
+    def __init__(self, api_key, rate_limiter=None):
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter  # RateLimiter for this key's workspace limits, or None
+        self.in_flight = 0
+        self.requests = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    @property
+    def label(self):
+        """Enough of the key to tell keys apart in logs without printing the secret"""
+        return f"...{self.api_key[-4:]}"
+
+
+class ApiKeyPool:
+    """Routes each request to the API key with the most headroom, ejecting keys that fail auth or exhaust their quota"""
+
+    AUTH_ERRORS = (401, 403)
+
+    def __init__(self, api_keys, requests_per_minute=None, input_tokens_per_minute=None,
+                 output_tokens_per_minute=None, eject_seconds=60.0, auth_eject_seconds=900.0):
+        if not api_keys:
+            raise ValueError("ApiKeyPool needs at least one API key")
+        limits = (requests_per_minute, input_tokens_per_minute, output_tokens_per_minute)
+        self.keys = [ApiKey(api_key, RateLimiter(*limits) if any(limits) else None) for api_key in api_keys]
+        self.eject_seconds = eject_seconds  # Ejection after a 429 without a Retry-After header
+        self.auth_eject_seconds = auth_eject_seconds  # Ejection after a 401/403, long enough to fix the key
+        self._by_key = {key.api_key: key for key in self.keys}
+        self._lock = threading.Lock()
+
+    def rate_limiter(self, api_key):
+        """The rate limiter of one key, or None if the pool doesn't limit its keys"""
+        return self._by_key[api_key].rate_limiter
+
+    def _claim(self):
+        """Claim the healthy key with the most headroom per in-flight request, or return the seconds until one is back"""
+        with self._lock:
+            now = time.monotonic()
+            healthy = [key for key in self.keys if key.ejected_until <= now]
+            if not healthy:
+                return None, min(key.ejected_until for key in self.keys) - now
+            key = max(healthy, key=lambda key: (key.rate_limiter.headroom() if key.rate_limiter else 1.0)
+                      / (1 + key.in_flight))
+            key.in_flight += 1
+            key.requests += 1
+            return key, 0
+
+    def acquire(self):
+        """Block until a key is healthy and claim it"""
+        key, wait = self._claim()
+        while key is None:
+            time.sleep(wait)
+            key, wait = self._claim()
+        return key
+
+    async def acquire_async(self):
+        """Wait without blocking the event loop until a key is healthy and claim it"""
+        key, wait = self._claim()
+        while key is None:
+            await asyncio.sleep(wait)
+            key, wait = self._claim()
+        return key
+
+    def release(self, key, error=None):
+        """Hand a key back, ejecting it for a while if the error was about the key rather than the request"""
+        status_code = getattr(error, 'status_code', None)
+        with self._lock:
+            key.in_flight -= 1
+            if status_code in self.AUTH_ERRORS:
+                seconds = self.auth_eject_seconds
+            elif status_code == 429:
+                seconds = retry_after_seconds(error) or self.eject_seconds
+            else:
+                return
+            key.ejected_until = time.monotonic() + seconds
+            key.ejections += 1
+        print(f"API key {key.label} ejected for {seconds:.0f}s after a {status_code} response")
+
+    def can_reroute(self, error):
+        """True if the error ejected a key and another key can take the request right now"""
+        if getattr(error, 'status_code', None) not in self.AUTH_ERRORS + (429,):
+            return False
+        with self._lock:
+            now = time.monotonic()
+            return any(key.ejected_until <= now for key in self.keys)
+
+    def stats(self):
+        """Per-key request and ejection counts for the run report"""
+        with self._lock:
+            return [{'key': key.label, 'requests': key.requests, 'ejections': key.ejections,
+                     'limiter': key.rate_limiter.stats() if key.rate_limiter else None} for key in self.keys]
+
+
+class HedgePolicy:
+    """Decides when a slow Claude call gets a duplicate request, based on the observed latency distribution"""
+
+    def __init__(self, percentile=0.95, max_fraction=0.05, min_samples=20, window=500):
+        self.percentile = percentile  # Hedge calls still running past this latency percentile
+        self.max_fraction = max_fraction  # Cap on hedged requests as a fraction of all requests
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def start_request(self):
+        """Count a request and return the seconds to wait before hedging it, or None to not hedge"""
+        with self._lock:
+            self.requests += 1
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+
+    def try_hedge(self):
+        """Claim a hedge if that keeps hedged requests under max_fraction"""
+        with self._lock:
+            if self.hedged + 1 > self.max_fraction * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def cancel_hedge(self):
+        """Give back a claimed hedge that was never sent"""
+        with self._lock:
+            self.hedged -= 1
+
+    def record(self, latency, hedge_won=False):
+        with self._lock:
+            self._latencies.append(latency)
+            if hedge_won:
+                self.hedge_wins += 1
+
+    def stats(self):
+        """Hedging metrics for the run report"""
+        with self._lock:
+            return {'requests': self.requests, 'hedged': self.hedged, 'hedge_wins': self.hedge_wins}
+
+
+class StragglerPolicy:
+    """Cancels calls running far past the latency of similar-sized requests so they can be sent again"""
+
+    SHAPES = ((500, 'small'), (2000, 'medium'), (8000, 'large'))  # Prompt tokens below each bound; above is 'huge'
+
+    def __init__(self, percentile=0.95, multiplier=3.0, min_samples=20, window=500, max_requeues=2):
+        self.percentile = percentile
+        self.multiplier = multiplier  # A call is a straggler once it runs this many times past the percentile
+        self.min_samples = min_samples
+        self.max_requeues = max_requeues  # Straggling attempts re-sent per call before it's left to the retry policy
+        self.attempts = {}
+        self.stragglers = {}
+        self._window = window
+        self._latencies = {}  # Per shape, plus None for every request
+        self._lock = threading.Lock()
+
+    def shape(self, tokens):
+        """Size bucket of a prompt, so stragglers are judged against requests of a similar size"""
+        for bound, name in self.SHAPES:
+            if tokens < bound:
+                return name
+        return 'huge'
+
+    def deadline(self, shape):
+        """Seconds after which a request of this shape counts as a straggler, or None while there's too little data"""
+        with self._lock:
+            for latencies in (self._latencies.get(shape), self._latencies.get(None)):
+                if latencies and len(latencies) >= self.min_samples:
+                    ordered = sorted(latencies)
+                    return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))] * self.multiplier
+            return None
+
+    def record(self, shape, latency=None):
+        """Record a finished attempt's latency, or a straggler when latency is None"""
+        with self._lock:
+            self.attempts[shape] = self.attempts.get(shape, 0) + 1
+            if latency is None:
+                self.stragglers[shape] = self.stragglers.get(shape, 0) + 1
+                return
+            for key in (shape, None):
+                self._latencies.setdefault(key, deque(maxlen=self._window)).append(latency)
+
+    def stats(self):
+        """Straggler counts and rates per shape for the run report"""
+        with self._lock:
+            return {shape: {'attempts': attempts, 'stragglers': self.stragglers.get(shape, 0),
+                            'rate': self.stragglers.get(shape, 0) / attempts}
+                    for shape, attempts in self.attempts.items()}
+
+
+class DeadlinePlanner:
+    """Decides whether another module can still finish before a wall-clock deadline, from latencies seen so far"""
+
+    def __init__(self, seconds, percentile=0.9, safety_margin=1.25, progress_every=10):
+        self.deadline = time.monotonic() + seconds
+        self.percentile = percentile  # Latency percentile a new module is assumed to take
+        self.safety_margin = safety_margin
+        self.progress_every = progress_every  # Print a progress estimate after this many finished modules
+        self.skipped = []
+        self._latencies = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds left before the deadline"""
+        return self.deadline - time.monotonic()
+
+    def projected_seconds(self):
+        """Expected time for one more module, or None before any module has finished"""
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))] * self.safety_margin
+
+    def fits(self):
+        """True if a module dispatched now is projected to finish before the deadline"""
+        projected = self.projected_seconds()
+        if projected is None:
+            return self.remaining() > 0  # Nothing observed yet; the request timeout still enforces the deadline
+        return projected <= self.remaining()
+
+    def skip(self, result):
+        result.skipped = 'deadline'
+        with self._lock:
+            self.skipped.append(result)
+
+    def record(self, seconds):
+        """Record how long a finished module took and print a progress estimate now and then"""
+        with self._lock:
+            self._latencies.append(seconds)
+            done = len(self._latencies)
+            mean = sum(self._latencies) / done
+        if done % self.progress_every == 0:
+            print(f"Progress: {done} modules done, {mean:.1f}s mean per module, "
+                  f"{max(self.remaining(), 0.0):.0f}s to the deadline")
+
+
+class CostBudget:
+    """Caps a run's spend in tokens or dollars, admitting modules only while their estimated cost still fits"""
+
+    CACHE_WRITE_PRICE = 1.25  # Prompt cache writes and reads, as multiples of the input price
+    CACHE_READ_PRICE = 0.1
+
+    def __init__(self, max_tokens=None, max_dollars=None, input_price=0.25, output_price=1.25):
+        if max_tokens is None and max_dollars is None:
+            raise ValueError("CostBudget needs max_tokens, max_dollars or both")
+        self.max_tokens = max_tokens  # Input plus output tokens
+        self.max_dollars = max_dollars
+        self.input_price = input_price  # Dollars per million tokens; the defaults are claude-3-haiku's
+        self.output_price = output_price
+        self.estimated = [0, 0]  # Input and output tokens estimated for every admitted module
+        self.estimated_cache = [0, 0]  # Of which repo context expected to be written to and read from the prompt cache
+        self.actual = [0, 0]  # Input and output tokens the API reported
+        self.cache_tokens = [0, 0]  # Input tokens written to and read from the prompt cache
+        self.skipped = []
+        self._reserved = {}  # Estimated (tokens, dollars) of modules still in flight
+        self._lock = threading.Lock()
+
+    def dollars(self, input_tokens, output_tokens):
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / 1_000_000
+
+    def cost(self, input_tokens, output_tokens, cache_write_tokens=0, cache_read_tokens=0):
+        """(tokens, dollars) of uncached input, output and prompt cache writes and reads, each at its own price"""
+        cached_input = cache_write_tokens * self.CACHE_WRITE_PRICE + cache_read_tokens * self.CACHE_READ_PRICE
+        return (input_tokens + output_tokens + cache_write_tokens + cache_read_tokens,
+                self.dollars(input_tokens, output_tokens) + self.dollars(cached_input, 0))
+
+    def spent(self):
+        """Actual (tokens, dollars) so far"""
+        return self.cost(*self.actual, *self.cache_tokens)
+
+    def estimate(self):
+        """Estimated (tokens, dollars) of every admitted module"""
+        return self.cost(*self.estimated, *self.estimated_cache)
+
+    def reserve(self, result, input_tokens, output_tokens, cache_write_tokens=0, cache_read_tokens=0):
+        """Admit a module if its estimated cost fits next to what's spent and reserved, else mark it skipped"""
+        tokens, dollars = self.cost(input_tokens, output_tokens, cache_write_tokens, cache_read_tokens)
+        with self._lock:
+            spent_tokens, spent_dollars = self.spent()
+            reserved_tokens = sum(cost[0] for cost in self._reserved.values())
+            reserved_dollars = sum(cost[1] for cost in self._reserved.values())
+            if ((self.max_tokens is not None and spent_tokens + reserved_tokens + tokens > self.max_tokens) or
+                    (self.max_dollars is not None and spent_dollars + reserved_dollars + dollars > self.max_dollars)):
+                result.skipped = 'budget'
+                self.skipped.append(result)
+                return False
+            self._reserved[id(result)] = (tokens, dollars)
+            self.estimated[0] += input_tokens
+            self.estimated[1] += output_tokens
+            self.estimated_cache[0] += cache_write_tokens
+            self.estimated_cache[1] += cache_read_tokens
+            return True
+
+    def release(self, result):
+        """Drop a finished module's reservation; its actual usage has been recorded by then"""
+        with self._lock:
+            self._reserved.pop(id(result), None)
+
+    def record_usage(self, input_tokens, output_tokens, cache_write_tokens=0, cache_read_tokens=0):
+        with self._lock:
+            self.actual[0] += input_tokens
+            self.actual[1] += output_tokens
+            self.cache_tokens[0] += cache_write_tokens
+            self.cache_tokens[1] += cache_read_tokens
+
+
+class SingleFlight:
+    """Lets concurrent identical requests share one in-flight call and its result"""
+
+    def __init__(self):
+        self.coalesced = 0  # Calls answered by another call already in flight
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, call):
+        """Return call()'s result, or wait for the result of an identical call already in flight"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self._calls[key] = Future()
+        if future is not None:
+            return future.result()
+        future = self._calls[key]
+        try:
+            result = call()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, call):
+        """Async counterpart of do; call is a coroutine function"""
+        with self._lock:
+            future = self._async_calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self._async_calls[key] = asyncio.get_running_loop().create_future()
+        if future is not None:
+            return await asyncio.shield(future)  # A cancelled follower mustn't cancel the shared call
+        future = self._async_calls[key]
+        try:
+            result = await call()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark it retrieved, there may be no followers to await it
+            raise
+        finally:
+            with self._lock:
+                del self._async_calls[key]
+
+
+class ResponseCache:
+    """Persistent SQLite store of Claude responses, keyed by a hash of the full request.
+
+    Bounded by max_bytes, evicting the least recently used responses first, and by ttl seconds since a
+    response was stored. Several processes can share one file: SQLite serialises the writers, and the
+    total size is kept in a one-row table by triggers, so checking it never scans the responses.
+    """
+
+    EVICT_TO = 0.9  # Evict down to this fraction of max_bytes, so eviction doesn't run on every insert
+
+    def __init__(self, path, max_bytes=None, ttl=None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes  # Upper bound on stored response bytes, or None for no limit
+        self.ttl = ttl  # Seconds a response stays valid after it was stored, or None to keep it until evicted
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit, so the only transactions are the explicit ones below
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+        self._db.execute("PRAGMA synchronous=NORMAL")  # No fsync per insert; a lost entry is just a miss
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._create_schema()
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_stored = 0  # Response bytes added by this run
+        self.evicted = 0  # Responses this process evicted or pruned
+
+    def _create_schema(self):
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                         "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(responses)")}
+        if 'accessed' not in columns:
+            # Caches written before eviction existed
+            self._db.execute("ALTER TABLE responses ADD COLUMN accessed REAL NOT NULL DEFAULT 0")
+            self._db.execute("ALTER TABLE responses ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE responses SET accessed = created, size = LENGTH(CAST(response AS BLOB))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                         "entries INTEGER NOT NULL, bytes INTEGER NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO totals "
+                         "SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM responses")
+        self._db.execute("CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN "
+                         "UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size; END")
+        self._db.execute("CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN "
+                         "UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size; END")
+        self._db.execute("CREATE TRIGGER IF NOT EXISTS responses_resize AFTER UPDATE OF size ON responses BEGIN "
+                         "UPDATE totals SET bytes = bytes - OLD.size + NEW.size; END")
+
+    def get(self, key):
+        """The stored response for key, or None if there is none or it has expired"""
+        now = time.time()
+        expired_before = now - self.ttl if self.ttl is not None else float('-inf')
+        with self._lock:
+            row = self._db.execute("SELECT response FROM responses WHERE key = ? AND created >= ?",
+                                   (key, expired_before)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        size = len(response.encode())
+        with self._lock:
+            self._db.execute("INSERT INTO responses (key, response, created, accessed, size) VALUES (?, ?, ?, ?, ?) "
+                             "ON CONFLICT (key) DO UPDATE SET response = excluded.response, "
+                             "created = excluded.created, accessed = excluded.accessed, size = excluded.size",
+                             (key, response, now, now, size))
+            self.bytes_stored += size
+            if self.max_bytes is not None and self._totals()[1] > self.max_bytes:
+                self._evict(self.max_bytes * self.EVICT_TO)
+
+    def prune(self, max_bytes=None, ttl=None):
+        """Delete expired responses, then least recently used ones until the cache fits; returns how many went"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            evicted = self.evicted
+            if ttl is not None:
+                self._transaction("DELETE FROM responses WHERE created < ?", (time.time() - ttl,))
+            if max_bytes is not None:
+                self._evict(max_bytes)
+            return self.evicted - evicted
+
+    def clear(self):
+        with self._lock:
+            return self._transaction("DELETE FROM responses")
+
+    def _evict(self, target_bytes):
+        """Delete least recently used responses until at most target_bytes are stored"""
+        self._db.execute("BEGIN IMMEDIATE")  # Another process may be evicting too; take turns
+        try:
+            excess = self._totals()[1] - target_bytes
+            victims = []
+            # Walks the accessed index from the oldest end, so only the responses being evicted are read
+            for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                if excess <= 0:
+                    break
+                victims.append((key,))
+                excess -= size
+            self._db.executemany("DELETE FROM responses WHERE key = ?", victims)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self.evicted += len(victims)
+
+    def _transaction(self, sql, params=()):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = self._db.execute(sql, params).rowcount
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self.evicted += deleted
+        return deleted
+
+    def _totals(self):
+        return self._db.execute("SELECT entries, bytes FROM totals").fetchone()
+
+    def stats(self):
+        with self._lock:
+            entries, total_bytes = self._totals()
+            oldest, newest = self._db.execute("SELECT MIN(accessed), MAX(accessed) FROM responses").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'bytes_stored': self.bytes_stored,
+                'evicted': self.evicted, 'entries': entries, 'total_bytes': total_bytes,
+                'oldest_access': oldest, 'newest_access': newest}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def is_docstring(node):
+    """Whether a statement is a bare string literal, as docstrings are"""
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+def is_overload_error(error):
+    """True for rate-limit (429) and overloaded (529) responses"""
+    return getattr(error, 'status_code', None) in (429, 529)
+
+
+def retry_after_seconds(error):
+    """Seconds the server asked us to wait in a Retry-After header, or None if it didn't say"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after') is not None:
+            return float(headers['retry-after'])
+    except ValueError:
+        pass  # An HTTP date; fall back to our own backoff rather than trust the clocks to agree
+    return None
+
+
+class RetryPolicy:
+    """Which failed Claude calls to retry and for how long to back off, within a per-run retry budget"""
+
+    RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504, 529)
+
+    def __init__(self, max_delay=60.0, budget_ratio=0.2, min_budget=10):
+        self.max_delay = max_delay  # Cap on our own backoff; a server's Retry-After is honoured as given
+        self.budget_ratio = budget_ratio  # Retries allowed as a fraction of first attempts
+        self.min_budget = min_budget  # Retries always allowed, so a short run can still ride out a blip
+        self.requests = 0
+        self.retries = 0
+        self.budget_exhausted = 0
+        self.backoff_seconds = 0.0
+        self.retries_by_reason = {}
+        self._lock = threading.Lock()
+
+    def is_retryable(self, error):
+        """True for connection failures, rate limits, overload and transient server errors"""
+        if isinstance(error, anthropic.APIConnectionError):
+            return True
+        return getattr(error, 'status_code', None) in self.RETRYABLE_STATUS_CODES
+
+    def start_request(self):
+        """Count a first attempt, which earns budget for later retries"""
+        with self._lock:
+            self.requests += 1
+
+    def try_retry(self, error):
+        """Spend one retry from the budget, or return False if the run has used up its share"""
+        reason = getattr(error, 'status_code', None) or 'connection'
+        with self._lock:
+            if self.retries >= self.min_budget + self.budget_ratio * self.requests:
+                self.budget_exhausted += 1
+                return False
+            self.retries += 1
+            self.retries_by_reason[reason] = self.retries_by_reason.get(reason, 0) + 1
+            return True
+
+    def backoff(self, error, previous_delay, initial_delay):
+        """Seconds to wait before the next attempt: decorrelated jitter, but never sooner than Retry-After"""
+        delay = min(self.max_delay, random.uniform(initial_delay, max(initial_delay, previous_delay * 3)))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self._lock:
+            self.backoff_seconds += delay
+        return delay
+
+    def stats(self):
+        """Retry metrics for the run report"""
+        with self._lock:
+            return {'requests': self.requests, 'retries': self.retries, 'budget_exhausted': self.budget_exhausted,
+                    'backoff_seconds': self.backoff_seconds, 'by_reason': dict(self.retries_by_reason)}
+
+
+class CircuitBreaker:
+    """Pauses Claude calls while the API is degraded, probing with half-open requests until it recovers"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=0.5, window=20, min_calls=10, open_seconds=30.0, max_open_seconds=300.0,
+                 half_open_probes=1, probe_wait=1.0):
+        self.failure_threshold = failure_threshold  # Failure rate over the window that opens the breaker
+        self.min_calls = min_calls  # Outcomes needed before the failure rate is trusted
+        self.open_seconds = open_seconds  # Pause before the first probe; doubles each time a probe fails
+        self.max_open_seconds = max_open_seconds
+        self.half_open_probes = half_open_probes  # Requests let through at once to test a recovering API
+        self.probe_wait = probe_wait  # How often waiting calls check back while probes are in flight
+        self.state = self.CLOSED
+        self.opened = 0
+        self.open_time = 0.0
+        self._outcomes = deque(maxlen=window)
+        self._cooldown = open_seconds
+        self._open_until = 0.0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._epoch = 0  # Bumped on every state change, so a stale probe can't give back a newer probe's slot
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_failure(error):
+        """True for errors that mean the API itself is struggling: connection failures, 429, 5xx and 529"""
+        if isinstance(error, anthropic.APIConnectionError):
+            return True
+        status_code = getattr(error, 'status_code', None)
+        return status_code is not None and (status_code == 429 or status_code >= 500)
+
+    def before_call(self):
+        """Return (seconds to wait before asking again, 0 to go ahead now; probe ticket or None).
+
+        A call let through as a half-open probe must hand its ticket to release_probe once it's done.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._open_until - time.monotonic()
+                if remaining > 0:
+                    return remaining, None
+                self._transition(self.HALF_OPEN, "probing the API")
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    return self.probe_wait, None
+                self._probes += 1
+                return 0, self._epoch
+            return 0, None
+
+    def release_probe(self, ticket):
+        """Free a probe's slot if its call ended without an outcome that moved the breaker on"""
+        with self._lock:
+            if ticket == self._epoch and self.state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, error=None):
+        """Record a call's outcome and return True if its failure found or left the breaker open"""
+        failed = error is not None and self.is_failure(error)
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if failed:
+                    self._cooldown = min(self._cooldown * 2, self.max_open_seconds)
+                    self._open(f"probe failed ({error})")
+                else:
+                    self._cooldown = self.open_seconds
+                    self._outcomes.clear()
+                    self._transition(self.CLOSED, "the API has recovered")
+            elif self.state == self.CLOSED:
+                self._outcomes.append(failed)
+                failures = sum(self._outcomes)
+                if len(self._outcomes) >= self.min_calls and failures >= self.failure_threshold * len(self._outcomes):
+                    self._open(f"{failures} of the last {len(self._outcomes)} calls failed")
+            return failed and self.state != self.CLOSED
+
+    def _open(self, reason):
+        if self.state == self.CLOSED:
+            self._opened_at = time.monotonic()
+        self._open_until = time.monotonic() + self._cooldown
+        self.opened += 1
+        self._transition(self.OPEN, f"{reason}; pausing calls for {self._cooldown:.1f}s")
+
+    def _transition(self, state, reason):
+        if self.state != self.CLOSED and state == self.CLOSED:
+            self.open_time += time.monotonic() - self._opened_at
+        self.state = state
+        self._probes = 0
+        self._epoch += 1
+        print(f"Circuit breaker {state}: {reason}")
+
+    def stats(self):
+        """Breaker metrics for the run report"""
+        with self._lock:
+            return {'state': self.state, 'opened': self.opened, 'open_time': self.open_time}
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight requests: grows additively while responses are healthy, halves on 429/529"""
+
+    def __init__(self, initial=4, minimum=1, maximum=64, decrease_factor=0.5, latency_tolerance=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance  # Latency above baseline * tolerance stops growth
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self.peak_limit = self.limit
+        self._baseline_latency = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._async_condition = None
+        self._async_loop = None
+
+    @property
+    def current(self):
+        """Current concurrency limit"""
+        return int(self.limit)
+
+    def _try_acquire(self):
+        with self._condition:  # Reentrant, so this also works as a wait_for predicate
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def _release(self, outcome, started, latency):
+        with self._condition:
+            self.in_flight -= 1
+            if outcome == 'overloaded':
+                # Requests sent before the last cut were sized for the old limit; don't cut twice for them
+                if started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+            elif outcome == 'success':
+                if self._baseline_latency is None:
+                    self._baseline_latency = latency
+                if latency <= self._baseline_latency * self.latency_tolerance and self.limit < self.maximum:
+                    # +1 per full window of successful requests
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                    self.increases += 1
+                    self.peak_limit = max(self.peak_limit, self.limit)
+                self._baseline_latency = 0.9 * self._baseline_latency + 0.1 * latency
+            self._condition.notify_all()
+
+    def _get_async_condition(self):
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_condition = asyncio.Condition()
+            self._async_loop = loop
+        return self._async_condition
+
+    @staticmethod
+    def _outcome(error):
+        return 'overloaded' if is_overload_error(error) else 'error'
+
+    @contextmanager
+    def slot(self):
+        """Hold one unit of concurrency for a blocking API call"""
+        with self._condition:
+            self._condition.wait_for(self._try_acquire)
+        started = time.monotonic()
+        outcome = 'success'
+        try:
+            yield
+        except Exception as e:
+            outcome = self._outcome(e)
+            raise
+        finally:
+            self._release(outcome, started, time.monotonic() - started)
+
+    @asynccontextmanager
+    async def slot_async(self):
+        """Hold one unit of concurrency for an awaited API call"""
+        condition = self._get_async_condition()
+        async with condition:
+            await condition.wait_for(self._try_acquire)
+        started = time.monotonic()
+        outcome = 'success'
+        try:
+            yield
+        except Exception as e:
+            outcome = self._outcome(e)
+            raise
+        finally:
+            self._release(outcome, started, time.monotonic() - started)
+            async with condition:
+                condition.notify_all()
+
+    def stats(self):
+        """Concurrency metrics for the run report"""
+        with self._condition:
+            return {
+                'current': self.current,
+                'peak': int(self.peak_limit),
+                'in_flight': self.in_flight,
+                'increases': self.increases,
+                'decreases': self.decreases,
+            }
+
+
+@asynccontextmanager
+async def _no_slot():
+    yield
+
+
 class GitHubTestGenerator:
-    def __init__(self, repo_url, claude_api_key):
+    MODEL = "claude-3-haiku-20240307"  # Or another Claude 3 model available to you
+    MAX_TOKENS = 4000
+    TEMPERATURE = 0.3
+
+    KEEPALIVE_EXPIRY = 30.0  # Seconds an idle pooled connection is kept open
+    REQUEST_TIMEOUT = 600.0  # Long completions can take minutes
+    CONNECT_TIMEOUT = 10.0
+    SCHEDULES = ('longest-first', 'shortest-first')
+    PROMPT_OVERHEAD_TOKENS = 60  # Instructions wrapped around the source in _build_prompt
+    QUEUE_SIZE_PER_WORKER = 2  # Bound on the discover -> prompt -> call queues, per API worker
+    WRITE_WORKERS = 4
+    BATCH_STATE_FILE = '.testotron_batches.json'  # Pending batches, kept in the repo dir so a restart can resume
+    BATCH_MAX_REQUESTS = 100000
+    BATCH_MAX_BYTES = 200 * 1024 * 1024  # Headroom under the 256 MB batch request limit
+    BATCH_API_RETRIES = 2  # SDK retries for batch submit/poll calls, which bypass RetryPolicy
+    SKIPPED_FILE = '.testotron_skipped.txt'  # Modules a run deadline or cost budget left without tests
+    OUTPUT_TOKEN_RATIO = 1.5  # Generated tests run longer than the module they cover
+    REPO_CONTEXT_MAX_TOKENS = 20000  # Cap on the package overview shared by every prompt for a repo
+    JOURNAL_FILE = '.testotron_journal.jsonl'  # Module outcomes of an unfinished run, replayed by resume=True
+    MANIFEST_FILE = '.testotron_manifest.json'  # Commit and per-module source hashes behind the tests, for incremental=True
+    DRAIN_TIMEOUT = 60.0  # Seconds in-flight calls get to finish after a stop is requested
+
+    def __init__(self, repo_url, claude_api_key, mode="async", max_concurrency=8, workers=None,
+                 http_limits=None, http_timeout=None, rate_limiter=None, concurrency_controller=None,
+                 batch_poll_interval=60, stream=False, schedule=None, hedge_policy=None, retry_policy=None,
+                 circuit_breaker=None, file_timeout=None, straggler_policy=None, cost_budget=None, resume=False,
+                 response_cache=None, repo_context=False, incremental=False, per_symbol=False):
+        if schedule is not None and schedule not in self.SCHEDULES:
+            raise ValueError(f"Unknown schedule {schedule!r}, expected one of {self.SCHEDULES}")
         self.repo_url = repo_url
-        self.claude_api_key = claude_api_key
+        if isinstance(claude_api_key, (list, tuple)):
+            claude_api_key = ApiKeyPool(claude_api_key)
+        self.key_pool = claude_api_key if isinstance(claude_api_key, ApiKeyPool) else None  # Spreads calls over several keys
+        self.claude_api_key = self.key_pool.keys[0].api_key if self.key_pool else claude_api_key
+        self.mode = mode  # "async" fans out over AsyncAnthropic, "sequential" calls one file at a time,
+                          # "batch" submits everything through the Message Batches API
+        self.max_concurrency = max_concurrency  # Upper bound on in-flight requests in async mode
+        self.workers = workers  # Thread pool size for callers that can't run an event loop
+        self.http_limits = http_limits  # httpx.Limits override; sized from the concurrency level by default
+        self.http_timeout = http_timeout  # httpx.Timeout override
+        self.rate_limiter = rate_limiter  # RateLimiter shared by every worker, or None for no client-side limits
+        self.concurrency_controller = concurrency_controller  # AdaptiveConcurrency, adjusts in-flight requests at runtime
+        self.batch_poll_interval = batch_poll_interval  # Seconds between batch status checks
+        self.stream = stream  # Stream responses straight into the test files instead of buffering them
+        self.schedule = schedule  # "longest-first" minimises makespan, "shortest-first" time to first results
+        self.hedge_policy = hedge_policy  # HedgePolicy; duplicates calls that run past a latency percentile
+        self.retry_policy = retry_policy or RetryPolicy()  # Backoff and retry budget shared by every call in the run
+        self.circuit_breaker = circuit_breaker  # CircuitBreaker; holds calls back while the API is degraded
+        self.file_timeout = file_timeout  # Seconds one module may spend across all its attempts, or None for no limit
+        self.straggler_policy = straggler_policy  # StragglerPolicy; cancels and re-sends unusually slow calls
+        self.single_flight = SingleFlight()  # Shares one call between identical prompts in flight at once
+        self.deadline_planner = None  # DeadlinePlanner while a run has a deadline
+        self.cost_budget = cost_budget  # CostBudget; modules are admitted in priority order until it runs out
+        self.resume = resume  # Skip modules an interrupted run already finished, per its journal
+        self.response_cache = response_cache  # ResponseCache; unchanged modules reuse the response of an earlier run
+        self.repo_context = repo_context  # Prefix every prompt with a package overview, sent once and prompt-cached
+        self.prompt_cache_tokens = {'write': 0, 'read': 0, 'uncached': 0}  # Input tokens, with repo_context
+        self._usage_lock = threading.Lock()
+        self._repo_context = None  # This repo's package overview, while generating with repo_context
+        self._context_primed = False  # A call has written the overview to the prompt cache
+        self._context_lock = threading.Lock()
+        self._async_context_lock = None
+        self.incremental = incremental  # Pull an existing clone and only regenerate modules changed since the last run
+        self._manifest = None  # Loaded MANIFEST_FILE, with incremental=True
+        self._unchanged = {}  # Source path -> test file of modules unchanged since the last run
+        self._removed_tests = []  # Tests of modules deleted since the last run
+        self.per_symbol = per_symbol  # Generate and cache tests per top-level function and class, then join them
+        self.symbol_stats = {'generated': 0, 'cached': 0}
+        if per_symbol and mode == 'batch':
+            raise ValueError("Per-symbol generation needs each symbol's response as it arrives; it can't use batch mode")
+        if per_symbol and response_cache is None:
+            raise ValueError("Per-symbol generation caches each symbol's tests; pass a response_cache")
+        if resume and mode == 'batch':
+            raise ValueError(f"Batch mode resumes its pending batches from {self.BATCH_STATE_FILE}; it keeps no journal")
+        self._stop_requested = threading.Event()
+        self._drain_deadline = None
+        self._loop = None  # Event loop of the running async pipeline, for cancelling its calls at the drain deadline
+        self._sends = set()  # Async API requests in flight
+        self._call_slots = None  # Semaphore capping the async pipeline's requests at max_concurrency
+        self._completed = {}  # Source path -> test file finished by an interrupted run
+        self._journal = None  # RunJournal of this repo's current run
+        self.results = []
+        self.pipeline_stats = {}
+        self.timings = {}  # Seconds spent cloning and generating
+        self._generation_started = None
+        self._clients = {}  # Per API key
+        self._async_clients = {}
+        self._client_lock = threading.Lock()
+        self._hedge_executor = None
         self.repo_dir = None
         self.language = None
         self.test_framework = None
@@ -23,8 +1208,12 @@ class GitHubTestGenerator:
         try:
             repo_name = self.repo_url.split('/')[-1].replace('.git', '')
             temp_dir = Path(tempfile.gettempdir())
-            self.repo_dir = temp_dir / repo_name
+            # Suffixed with a hash of the URL, so same-named repositories from different owners get their own clone
+            url_hash = hashlib.sha256(self.repo_url.encode()).hexdigest()[:8]
+            self.repo_dir = temp_dir / f"{repo_name}-{url_hash}"
             if self.repo_dir.exists():
+                if self.incremental:
+                    return self._pull_repository()
                 print(f"Repository already present at {self.repo_dir}, skipping clone.")
                 return True
             Repo.clone_from(self.repo_url, self.repo_dir)
@@ -33,6 +1222,15 @@ class GitHubTestGenerator:
             print(f"Error cloning repository: {e}")
             return False
     
+    def _pull_repository(self):
+        """Fast-forward an existing clone to the remote's latest commit; a failed pull keeps the checkout as is"""
+        try:
+            Repo(self.repo_dir).git.pull('--ff-only')
+            print(f"Repository already present at {self.repo_dir}, pulled the latest commits.")
+        except Exception as e:
+            print(f"Could not update {self.repo_dir}, generating for the current checkout: {e}")
+        return True
+
     def analyze_repository(self):
         """Determine the primary language and test framework"""
         # This would involve checking for package.json, requirements.txt, etc.
@@ -46,30 +1244,611 @@ class GitHubTestGenerator:
             return self._generate_python_tests()
         # Add other language handlers here
         
-    def _generate_python_tests(self):
+    def _generate_python_tests(self, mode=None, workers=None):
         """Generate pytest unit tests for Python code"""
         test_dir = self.repo_dir / 'tests'
         test_dir.mkdir(exist_ok=True)
-        
-        # Find all Python modules in the repo
+
+        mode = mode or self.mode
+        workers = workers or self.workers
+        if mode == 'async' and not workers:
+            # The async pipeline discovers modules itself so discovery overlaps with API calls
+            self.results = asyncio.run(self._generate_python_tests_async(test_dir))
+            return self.results
+
+        if mode != 'batch':
+            self._open_journal(self)  # Batch mode resumes from BATCH_STATE_FILE instead
+        self._load_manifest(self)
+        self._repo_context = self._build_repo_context(self)
+        py_files = list(self._changed_modules(self))
+        if mode == 'batch':
+            self.results = self._generate_python_tests_batch(py_files, test_dir)
+        elif workers:
+            self.results = self._generate_python_tests_threaded(py_files, test_dir, workers)
+        else:
+            self.results = self._generate_python_tests_sequential(py_files, test_dir)
+        return self.results
+
+    def _generate_python_tests_sequential(self, py_files, test_dir):
+        """Generate tests one module at a time"""
+        results = [GenerationResult(py_file) for py_file in py_files]
+        for result in self._dispatch_order(results):
+            # Analyze the Python file
+            module_name = result.source_file.stem
+            spec = importlib.util.spec_from_file_location(module_name, result.source_file)
+            module = importlib.util.module_from_spec(spec)
+
+            try:
+                self._generate_module_tests(result, test_dir)
+            except Exception as e:
+                result.error = e
+                print(f"Error generating tests for {result.source_file}: {e}")
+            self._journal_result(self, result)
+        return results
+
+    def _generate_python_tests_threaded(self, py_files, test_dir, workers):
+        """Send _call_claude_api calls to a thread pool, writing each file as its call completes"""
+        results = [GenerationResult(py_file) for py_file in py_files]
+        if self.concurrency_controller:
+            # Size the pool for the controller's ceiling; the controller decides how many calls run
+            workers = max(workers, self.concurrency_controller.maximum)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Each worker writes its file as soon as its call completes
+            futures = {
+                executor.submit(self._generate_module_tests, result, test_dir): result
+                for result in self._dispatch_order(results)
+            }
+            for future in as_completed(futures):
+                result = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    result.error = e
+                    print(f"Error generating tests for {result.source_file}: {e}")
+                self._journal_result(self, result)
+        # Results stay in discovery order regardless of completion order
+        return results
+
+    async def _generate_python_tests_async(self, test_dir):
+        """Run discover -> prompt -> call -> validate -> write as concurrent stages joined by queues"""
+        return await self._run_pipeline([self])
+
+    async def _run_pipeline(self, repos, clone_workers=None):
+        """Generate tests for every module of repos through one shared set of pipeline stages
+
+        With clone_workers, the repos are cloned in parallel first and each one is discovered as
+        soon as its clone finishes, so a small repo's modules keep the API workers busy while a
+        large one is still cloning.
+        """
+        loop = self._loop = asyncio.get_running_loop()
+        concurrency = self._concurrency_level()
+        # One call worker sends several requests at once in per-symbol mode, so the cap is held per attempt
+        self._call_slots = asyncio.Semaphore(concurrency)
+        stats = self.pipeline_stats = {
+            name: StageStats(name) for name in ('discover', 'prompt', 'call', 'validate', 'write')
+        }
+        # Inputs are bounded so discovery and file reads stay just ahead of the API workers. Completed
+        # responses are already paid for, so their queues are unbounded and slow writes never stall calls.
+        paths = asyncio.Queue(concurrency * self.QUEUE_SIZE_PER_WORKER)
+        prompts = asyncio.Queue(concurrency * self.QUEUE_SIZE_PER_WORKER)
+        responses = asyncio.Queue()
+        validated = asyncio.Queue()
+
+        def discover():
+            stats['discover'].start()
+            try:
+                for repo in self._ready_repos(repos, clone_workers):
+                    if self._stop_requested.is_set():
+                        break
+                    test_dir = repo.repo_dir / 'tests'
+                    test_dir.mkdir(exist_ok=True)
+                    self._open_journal(repo)
+                    self._load_manifest(repo)
+                    repo._repo_context = self._build_repo_context(repo)
+                    repo._async_context_lock = asyncio.Lock()
+                    repo.results = []
+                    repo._generation_started = time.monotonic()
+                    for result in self._discover_modules(repo, repo.results):
+                        if self._stop_requested.is_set():
+                            break
+                        stats['discover'].processed += 1
+                        job = PipelineJob(result, repo, test_dir)
+                        asyncio.run_coroutine_threadsafe(paths.put(job), loop).result()
+            finally:
+                # Always end the input, or the downstream stages would wait forever
+                asyncio.run_coroutine_threadsafe(paths.put(None), loop).result()
+                stats['discover'].finish()
+
+        async def build_prompt(job):
+            py_file = job.result.source_file
+            source_code = await loop.run_in_executor(None, py_file.read_text)
+            job.result.source_hash = self._source_hash(source_code)
+            job.prompt = self._build_prompt(source_code, py_file.stem, job.repo._repo_context)
+            if self.per_symbol:
+                job.source_code = source_code
+            return job
+
+        async def call(job):
+            with self._admitted(job.result, job.repo) as admitted:
+                if not admitted:
+                    return None
+                if self.per_symbol:
+                    job.test_code = await self._generate_symbol_tests_async(job.result, job.source_code, job.repo)
+                if job.test_code is None:
+                    job.test_code = self._cached_response(job.result, job.prompt)
+                if job.test_code is not None:
+                    return job
+                if not self.stream:
+                    async with self._context_priming_async(job.repo):
+                        job.test_code = await self._call_claude_api_async(job.prompt)
+                    job.fresh = True
+                    return job
+                # Streaming writes and validates the file itself, so the job skips the validate and write stages
+                py_file = job.result.source_file
+                with StreamingTestWriter(self._test_file_path(job.test_dir, py_file.stem),
+                                         lambda code: self._validate_test_code(code, py_file.stem)) as writer:
+                    async with self._context_priming_async(job.repo):
+                        await self._call_claude_api_async(job.prompt, writer=writer)
+            self._record_stream_metrics(job.result, writer)
+            if self.response_cache:
+                self._store_response(job.prompt, writer.test_file.read_text())
+            return None
+
+        async def validate(job):
+            job.test_code = self._validate_test_code(job.test_code, job.result.source_file.stem)
+            if job.fresh:
+                self._store_response(job.prompt, job.test_code)
+            return job
+
+        async def write(job):
+            py_file = job.result.source_file
+            job.result.test_file = await loop.run_in_executor(
+                None, self._write_test_file, job.test_dir, py_file.stem, job.test_code)
+            return None
+
+        try:
+            await asyncio.gather(
+                loop.run_in_executor(None, discover),
+                self._run_stage(stats['prompt'], paths, prompts, build_prompt),
+                self._run_stage(stats['call'], prompts, responses, call, workers=concurrency),
+                self._run_stage(stats['validate'], responses, validated, validate),
+                self._run_stage(stats['write'], validated, None, write, workers=self.WRITE_WORKERS),
+            )
+            return [result for repo in repos for result in repo.results]
+        finally:
+            self._loop = self._call_slots = None
+            # The async pool is bound to this event loop, so it can't outlive the run
+            await self._close_async_client()
+
+    async def _run_stage(self, stats, inbox, outbox, handler, workers=1):
+        """Feed jobs from inbox through handler on `workers` tasks; None marks the end of the input"""
+        stats.inbox = inbox
+        stats.start()
+
+        async def worker():
+            while True:
+                job = await inbox.get()
+                if job is None:
+                    await inbox.put(None)  # Let sibling workers see the end of the input too
+                    return
+                stats.observe_queue()
+                started = time.monotonic()
+                try:
+                    next_job = await handler(job)
+                except Exception as e:
+                    job.result.error = e
+                    stats.failed += 1
+                    print(f"Error generating tests for {job.result.source_file}: {e}")
+                    next_job = None
+                stats.busy_seconds += time.monotonic() - started
+                stats.processed += 1
+                if next_job is None:
+                    # The module has left the pipeline, written or failed
+                    job.repo.timings['generate'] = time.monotonic() - job.repo._generation_started
+                    self._journal_result(job.repo, job.result)
+                elif outbox is not None:
+                    await outbox.put(next_job)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        stats.finish()
+        if outbox is not None:
+            await outbox.put(None)
+
+    def _ready_repos(self, repos, clone_workers):
+        """Yield repos ready for discovery, cloning them clone_workers at a time when asked to"""
+        if not clone_workers:
+            yield from repos
+            return
+        with ThreadPoolExecutor(max_workers=clone_workers) as executor:
+            futures = {executor.submit(repo._timed_clone): repo for repo in repos}
+            for future in as_completed(futures):
+                repo = futures[future]
+                if future.result():
+                    repo.analyze_repository()
+                    if repo.language == 'python':
+                        yield repo
+
+    def _discover_modules(self, repo, results):
+        """Yield repo's modules as results in dispatch order, appending each to results in discovery order"""
+        if self.schedule or self.deadline_planner or self.cost_budget:
+            # Every module's cost must be known before the first one is dispatched
+            results.extend(GenerationResult(py_file) for py_file in self._changed_modules(repo))
+            yield from self._dispatch_order(results)
+            return
+        for py_file in self._changed_modules(repo):
+            result = GenerationResult(py_file)
+            results.append(result)
+            yield result
+
+    def _changed_modules(self, repo):
+        """Yield repo's modules that need tests, leaving out those unchanged since the last incremental run"""
+        for py_file in repo._iter_python_modules():
+            if str(py_file) not in repo._unchanged:
+                yield py_file
+
+    def _generate_python_tests_batch(self, py_files, test_dir):
+        """Submit every prompt as Message Batches, wait for them to end and write the results"""
+        state_file = self.repo_dir / self.BATCH_STATE_FILE
+        cached = []
+        if state_file.exists():
+            state = json.loads(state_file.read_text())
+            print(f"Resuming pending batches from {state_file}")
+        else:
+            cached, py_files = self._write_cached_tests(py_files, test_dir)
+            py_files, skipped = self._budget_batches(py_files)
+            cached += skipped
+            state = self._plan_batches(py_files)
+        self._submit_batches(state, state_file)
+
+        client = self._get_batch_client()
+        results = {custom_id: GenerationResult(self.repo_dir / source)
+                   for custom_id, source in state['requests'].items()}
+        for index, batch in enumerate(state['batches']):
+            if batch['id'] is None or self._wait_for_batch(batch['id']) is None:
+                # Stopped: the batches keep running on the API, and the state file lets the next run collect them
+                for pending in state['batches'][index:]:
+                    for custom_id in pending['custom_ids']:
+                        results[custom_id].skipped = 'cancelled'
+                print(f"Stopped waiting for batches; the next run picks them up from {state_file}")
+                return cached + list(results.values())
+            for entry in client.messages.batches.results(batch['id']):
+                result = results[entry.custom_id]
+                try:
+                    if entry.result.type != 'succeeded':
+                        raise RuntimeError(f"batch request {entry.result.type}")
+                    self._record_usage(entry.result.message)
+                    test_code = entry.result.message.content[0].text.strip()
+                    test_code = self._validate_test_code(test_code, result.source_file.stem)
+                    if self.response_cache:
+                        py_file = result.source_file
+                        prompt = self._build_prompt(py_file.read_text(), py_file.stem, self._repo_context)
+                        self._store_response(prompt, test_code)
+                    result.test_file = self._write_test_file(test_dir, result.source_file.stem, test_code)
+                except Exception as e:
+                    result.error = e
+                    print(f"Error generating tests for {result.source_file}: {e}")
+
+        # Every result is on disk, nothing left to resume
+        if state_file.exists():
+            state_file.unlink()
+        return cached + list(results.values())
+
+    def _write_cached_tests(self, py_files, test_dir):
+        """Write the tests the response cache already holds; returns their results and the modules still to submit"""
+        cached, remaining = [], []
+        for py_file in py_files:
+            result = GenerationResult(py_file)
+            prompt = self._build_prompt(py_file.read_text(), py_file.stem, self._repo_context)
+            test_code = self._cached_response(result, prompt)
+            if test_code is None:
+                remaining.append(py_file)
+                continue
+            test_code = self._validate_test_code(test_code, py_file.stem)
+            result.test_file = self._write_test_file(test_dir, py_file.stem, test_code)
+            cached.append(result)
+        return cached, remaining
+
+    def _budget_batches(self, py_files):
+        """With a cost budget, the modules that fit it in value order, and the skipped results of those that don't.
+
+        Every batch is paid for once submitted, so each admitted module's reservation stands for the whole run.
+        """
+        if not self.cost_budget:
+            return py_files, []
+        admitted, skipped = [], []
+        for result in self._dispatch_order([GenerationResult(py_file) for py_file in py_files]):
+            if self.cost_budget.reserve(result, *self._estimate_cost(result, self)):
+                admitted.append(result.source_file)
+            else:
+                skipped.append(result)
+        return admitted, skipped
+
+    def _plan_batches(self, py_files):
+        """Assign each module a custom_id and split the requests into batches under the API limits"""
+        state = {'requests': {}, 'batches': []}
+        batch, batch_bytes = None, 0
+        for index, py_file in enumerate(py_files):
+            custom_id = f"module-{index}"
+            state['requests'][custom_id] = str(py_file.relative_to(self.repo_dir))
+            size = py_file.stat().st_size + 1024  # Source plus prompt template and JSON overhead
+            if (batch is None or len(batch['custom_ids']) >= self.BATCH_MAX_REQUESTS
+                    or batch_bytes + size > self.BATCH_MAX_BYTES):
+                batch, batch_bytes = {'id': None, 'custom_ids': []}, 0
+                state['batches'].append(batch)
+            batch['custom_ids'].append(custom_id)
+            batch_bytes += size
+        return state
+
+    def _submit_batches(self, state, state_file):
+        """Create the batches that haven't been submitted yet, recording each id as soon as it exists"""
+        client = self._get_batch_client()
+        for batch in state['batches']:
+            if batch['id'] is not None:
+                continue
+            if self._stop_requested.is_set():
+                return
+            requests = []
+            for custom_id in batch['custom_ids']:
+                py_file = self.repo_dir / state['requests'][custom_id]
+                prompt = self._build_prompt(py_file.read_text(), py_file.stem, self._repo_context)
+                requests.append({'custom_id': custom_id, 'params': self._message_params(prompt)})
+            batch['id'] = client.messages.batches.create(requests=requests).id
+            print(f"Submitted batch {batch['id']} with {len(requests)} requests")
+            self._write_state(state, state_file)
+
+    def _write_state(self, state, state_file):
+        """Atomically persist a state file so a restart never sees a half-written one"""
+        tmp_file = state_file.with_suffix('.tmp')
+        tmp_file.write_text(json.dumps(state, indent=2))
+        os.replace(tmp_file, state_file)
+
+    def _wait_for_batch(self, batch_id):
+        """Poll a batch until it has finished processing; None if a stop is requested first"""
+        client = self._get_batch_client()
+        while True:
+            batch = client.messages.batches.retrieve(batch_id)
+            if batch.processing_status == 'ended':
+                return batch
+            counts = batch.request_counts
+            print(f"Batch {batch_id} in progress ({counts.processing} requests processing)")
+            if self._stop_requested.wait(self.batch_poll_interval):
+                return None
+
+    def _estimate_tokens(self, py_file):
+        """Estimate a module's input tokens from its size without reading it"""
+        return py_file.stat().st_size // 4 + self.PROMPT_OVERHEAD_TOKENS
+
+    def _dispatch_order(self, results):
+        """Order results for dispatch according to the schedule policy, estimating each module's cost"""
+        if self.deadline_planner or self.cost_budget:
+            # Against a deadline or budget, the modules with the most to test go first; among equals, the cheapest
+            for result in results:
+                result.estimated_tokens = self._estimate_tokens(result.source_file)
+            return sorted(results, key=lambda result: (-self._module_value(result.source_file),
+                                                       result.estimated_tokens))
+        if not self.schedule:
+            return results
+        for result in results:
+            result.estimated_tokens = self._estimate_tokens(result.source_file)
+        return sorted(results, key=lambda result: result.estimated_tokens,
+                      reverse=self.schedule == 'longest-first')
+
+    def _module_value(self, py_file):
+        """How much a module has to test: its public functions, classes and methods"""
+        try:
+            tree = ast.parse(py_file.read_text())
+        except (SyntaxError, UnicodeDecodeError, OSError):
+            return 0
+        return sum(1 for node in ast.walk(tree)
+                   if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+                   and not node.name.startswith('_'))
+
+    def _iter_python_modules(self):
+        """Yield the Python modules in the repo that should get tests as they are found"""
         for py_file in self.repo_dir.rglob('*.py'):
             if 'test' in str(py_file) or 'tests' in str(py_file):
                 continue  # Skip existing test files
-                
-            # Analyze the Python file
-            module_name = py_file.stem
-            spec = importlib.util.spec_from_file_location(module_name, py_file)
-            module = importlib.util.module_from_spec(spec)
-            
-            # Use Claude 4 to generate tests
-            test_code = self._ask_claude_to_generate_tests(py_file.read_text(), module_name)
-            
-            # Save the test file
-            test_file = test_dir / f"test_{module_name}.py"
-            test_file.write_text(test_code)
-            
-    def _ask_claude_to_generate_tests(self, source_code, module_name):
-        """Use Claude 4 API to generate unit tests"""
+            yield py_file
+
+    def _find_python_modules(self):
+        """List the Python modules in the repo that should get tests"""
+        return list(self._iter_python_modules())
+
+    def _test_file_path(self, test_dir, module_name):
+        return test_dir / f"test_{module_name}.py"
+
+    def _write_test_file(self, test_dir, module_name, test_code):
+        """Save generated test code as test_<module>.py"""
+        test_file = self._test_file_path(test_dir, module_name)
+        partial_file = test_file.with_name(test_file.name + '.partial')
+        partial_file.write_text(test_code)
+        os.replace(partial_file, test_file)  # An interrupted write never leaves half a test file
+        return test_file
+
+    def _generate_module_tests(self, result, test_dir):
+        """Generate and save the tests for result.source_file"""
+        py_file = result.source_file
+        with self._admitted(result) as admitted:
+            if not admitted:
+                return
+            source_code = py_file.read_text()
+            result.source_hash = self._source_hash(source_code)
+            prompt = self._build_prompt(source_code, py_file.stem, self._repo_context)
+            test_code = None
+            if self.per_symbol:
+                test_code = self._generate_symbol_tests(result, source_code)
+            if test_code is None:
+                test_code = self._cached_response(result, prompt)
+            streamed = test_code is None and self.stream
+            fresh = test_code is None
+            if streamed:
+                with StreamingTestWriter(self._test_file_path(test_dir, py_file.stem),
+                                         lambda code: self._validate_test_code(code, py_file.stem)) as writer:
+                    with self._context_priming():
+                        self._call_claude_api(prompt, writer=writer)
+            elif test_code is None:
+                # Use Claude 4 to generate tests
+                with self._context_priming():
+                    test_code = self._ask_claude_to_generate_tests(source_code, py_file.stem)
+        if streamed:
+            self._record_stream_metrics(result, writer)
+            if self.response_cache:
+                self._store_response(prompt, writer.test_file.read_text())
+            return
+        test_code = self._validate_test_code(test_code, py_file.stem)
+        if fresh:
+            self._store_response(prompt, test_code)
+
+        # Save the test file
+        result.test_file = self._write_test_file(test_dir, py_file.stem, test_code)
+
+    @contextmanager
+    def _admitted(self, result, repo=None):
+        """Around one module's call: yields whether it still needs doing and fits the run's deadline and budget"""
+        if str(result.source_file) in self._completed:
+            result.test_file = self._completed[str(result.source_file)]
+            yield False
+            return
+        if self._stop_requested.is_set():
+            result.skipped = 'cancelled'
+            yield False
+            return
+        if self.deadline_planner and not self.deadline_planner.fits():
+            self.deadline_planner.skip(result)
+            yield False
+            return
+        if self.cost_budget and not self.cost_budget.reserve(result, *self._estimate_cost(result, repo or self)):
+            yield False
+            return
+        started = time.monotonic() if self.deadline_planner else None
+        try:
+            yield True
+        finally:
+            if self.cost_budget:
+                self.cost_budget.release(result)
+        if self.deadline_planner and not result.cached:
+            # A cache hit says nothing about how long the API takes
+            self.deadline_planner.record(time.monotonic() - started)
+
+    @contextmanager
+    def _context_priming(self):
+        """Hold calls back until the first one has written the repo context to the prompt cache.
+
+        Calls sent before then would each pay to write the same prefix instead of reading it.
+        """
+        if self._repo_context is None or self._context_primed:
+            yield
+            return
+        with self._context_lock:
+            if not self._context_primed:
+                yield  # A failed call leaves priming to the next one
+                self._context_primed = True
+                return
+        yield
+
+    @asynccontextmanager
+    async def _context_priming_async(self, repo):
+        """Async counterpart of _context_priming, for one of the repos in the pipeline"""
+        if repo._repo_context is None or repo._context_primed:
+            yield
+            return
+        async with repo._async_context_lock:
+            if not repo._context_primed:
+                yield
+                repo._context_primed = True
+                return
+        yield
+
+    def _cached_response(self, result, prompt):
+        """The response an earlier run got for this exact request, or None on a miss or without a cache"""
+        if not self.response_cache:
+            return None
+        response = self.response_cache.get(self._request_key(prompt))
+        result.cached = response is not None
+        return response
+
+    def _store_response(self, prompt, response):
+        """Cache a response that has passed validation, so a bad one is never served again"""
+        if self.response_cache:
+            self.response_cache.put(self._request_key(prompt), response)
+
+    def _estimate_cost(self, result, repo):
+        """Estimated input, output, cache write and cache read tokens for one of repo's modules, from its size.
+
+        Per symbol, every symbol's prompt carries the rest of the module, so the input is paid once per symbol.
+        Each prompt also carries repo's context: the first call writes it to the prompt cache, the rest read it.
+        """
+        if result.estimated_tokens is None:
+            result.estimated_tokens = self._estimate_tokens(result.source_file)
+        calls = self._symbol_count(result.source_file) if self.per_symbol else 1
+        input_tokens = result.estimated_tokens * calls
+        output_tokens = min(self.MAX_TOKENS * calls, int(result.estimated_tokens * self.OUTPUT_TOKEN_RATIO))
+        if repo._repo_context is None:
+            return input_tokens, output_tokens, 0, 0
+        context_tokens = estimate_tokens(repo._repo_context)
+        cache_write = 0 if repo._context_primed else context_tokens
+        return input_tokens, output_tokens, cache_write, context_tokens * calls - cache_write
+
+    def _symbol_count(self, py_file):
+        """Number of calls per-symbol generation makes for a module: one per public top-level symbol, at least one"""
+        try:
+            tree = ast.parse(py_file.read_text())
+        except (SyntaxError, UnicodeDecodeError, OSError):
+            return 1
+        return max(1, sum(1 for node in tree.body
+                          if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+                          and not node.name.startswith('_')))
+
+    def _record_usage(self, response, input_usage=None):
+        """Count a response's actual tokens against the cost budget and prompt cache totals.
+
+        A stream passes its final event as the response and its message_start usage as input_usage.
+        """
+        if not self.cost_budget and not self.repo_context:
+            return
+        output_tokens = response.usage.output_tokens
+        input_usage = input_usage or response.usage
+        cache_write = getattr(input_usage, 'cache_creation_input_tokens', None) or 0
+        cache_read = getattr(input_usage, 'cache_read_input_tokens', None) or 0
+        if self.cost_budget:
+            self.cost_budget.record_usage(input_usage.input_tokens, output_tokens, cache_write, cache_read)
+        if self.repo_context:
+            with self._usage_lock:
+                self.prompt_cache_tokens['write'] += cache_write
+                self.prompt_cache_tokens['read'] += cache_read
+                self.prompt_cache_tokens['uncached'] += input_usage.input_tokens
+
+    def _write_skipped_list(self, repo):
+        """List the modules a deadline or budget left without tests next to the repo, or remove a stale list"""
+        skipped_file = repo.repo_dir / self.SKIPPED_FILE
+        skipped = [(result.source_file, result.skipped) for result in repo.results if result.skipped]
+        if skipped:
+            skipped_file.write_text(''.join(f"{path.relative_to(repo.repo_dir)}\t{reason}\n" for path, reason in skipped))
+        elif skipped_file.exists():
+            skipped_file.unlink()
+
+    def _validate_test_code(self, test_code, module_name):
+        """Unwrap a Markdown code fence if Claude added one and check the tests are valid Python"""
+        test_code = self._unwrap_code_fence(test_code)
+        try:
+            compile(test_code, f"test_{module_name}.py", 'exec')
+        except SyntaxError as e:
+            raise ValueError(f"Generated tests for {module_name} are not valid Python: {e}") from e
+        return test_code
+
+    @staticmethod
+    def _unwrap_code_fence(test_code):
+        """The code inside a Markdown code fence, or test_code unchanged if it isn't fenced"""
+        match = re.match(r"^```(?:python)?[ \t]*\n(.*?)\n?```$", test_code, re.DOTALL)
+        return match.group(1) if match else test_code
+
+    def _record_stream_metrics(self, result, writer):
+        result.test_file = writer.test_file
+        result.time_to_first_token = writer.time_to_first_token
+        result.tokens_per_second = writer.tokens_per_second
+
+    def _build_prompt(self, source_code, module_name, context=None):
+        """Build the test generation prompt for a module, after the repo's shared context if there is one"""
         prompt = f"""
         Please generate comprehensive unit tests for the following Python module: {module_name}.
         Use pytest framework and include tests for all major functions and edge cases.
@@ -79,15 +1858,498 @@ class GitHubTestGenerator:
         
         Return only the complete test file content with imports, no additional explanation.
         """
+        return self._with_context(prompt, context)
+
+    def _with_context(self, prompt, context):
+        """Put the repo's shared context, if any, in front of a prompt"""
+        if context is None:
+            return prompt
+        # The context is identical for every module in the repo, so it is marked as a cacheable prefix
+        return [
+            {"type": "text", "text": context, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": prompt},
+        ]
+
+    def _symbol_requests(self, source_code, module_name, context):
+        """(cache key, prompt) for each public top-level function and class, or None to generate the module whole.
+
+        The key hashes the symbol's AST and the rest of the module's, with positions and docstrings dropped,
+        so reformatting or editing comments changes no key. The repo context is left out of the key: a symbol's
+        tests stay valid when other modules change.
+        """
+        try:
+            tree = ast.parse(source_code)
+            normalized = ast.parse(source_code)  # A second copy to strip docstrings from
+        except SyntaxError:
+            return None
+        for node in ast.walk(normalized):
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and is_docstring(node.body[0]):
+                node.body = node.body[1:] or [ast.Pass()]
+        symbols, rest, rest_dump = [], [], []
+        for index, (node, normalized_node) in enumerate(zip(tree.body, normalized.body)):
+            if (isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+                    and not node.name.startswith('_')):
+                symbols.append((node, ast.dump(normalized_node)))
+                continue
+            rest.append(ast.get_source_segment(source_code, node) or '')
+            if not (index == 0 and is_docstring(node)):  # The module docstring doesn't count either
+                rest_dump.append(ast.dump(normalized_node))
+        if not symbols:
+            return None
+        requests = []
+        for node, symbol_dump in symbols:
+            key = hashlib.sha256(json.dumps(
+                [module_name, symbol_dump, rest_dump, self.MODEL, self.TEMPERATURE, self.MAX_TOKENS]).encode()).hexdigest()
+            requests.append((key, self._with_context(self._build_symbol_prompt(
+                node, source_code, module_name, "\n".join(rest)), context)))
+        return requests
+
+    def _build_symbol_prompt(self, node, source_code, module_name, rest):
+        """Build the test generation prompt for one function or class of a module"""
+        lines = source_code.splitlines()
+        first_line = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+        symbol_source = "\n".join(lines[first_line - 1:node.end_lineno])
+        return f"""
+        Please generate unit tests for `{node.name}` from the Python module: {module_name}.
+        Use pytest framework and cover its behaviour and edge cases. The module's other functions and classes
+        are tested separately, so start the name of every test and fixture with test_{node.name} or {node.name}.
+        The rest of the module, for context:
+
+        {rest}
+
+        The code to test is:
+
+        {symbol_source}
+
+        Return only the test code with the imports it needs, no additional explanation.
+        """
+
+    def _generate_symbol_tests(self, result, source_code):
+        """With per_symbol, tests for each of the module's symbols from the cache or the API, joined into one file"""
+        requests = self._symbol_requests(source_code, result.source_file.stem, self._repo_context)
+        if requests is None:
+            return None
+        deadline = self._call_deadline()  # file_timeout covers the module's calls together
+        pieces, generated = [], 0
+        for key, prompt in requests:
+            test_code = self._cached_symbol_tests(key)
+            if test_code is None:
+                with self._context_priming():
+                    test_code = self._call_claude_api(prompt, deadline=deadline)
+                test_code = self._store_symbol_tests(key, test_code)
+                generated += 1
+            pieces.append(test_code)
+        result.cached = not generated
+        return self._assemble_symbol_tests(pieces)
+
+    async def _generate_symbol_tests_async(self, result, source_code, repo):
+        """Async counterpart of _generate_symbol_tests; uncached symbols are sent at once, within max_concurrency"""
+        requests = self._symbol_requests(source_code, result.source_file.stem, repo._repo_context)
+        if requests is None:
+            return None
+        deadline = self._call_deadline()
+
+        async def symbol_tests(key, prompt):
+            test_code = self._cached_symbol_tests(key)
+            if test_code is not None:
+                return test_code, False
+            async with self._context_priming_async(repo):
+                test_code = await self._call_claude_api_async(prompt, deadline=deadline)
+            return self._store_symbol_tests(key, test_code), True
+
+        pieces = await asyncio.gather(*(symbol_tests(key, prompt) for key, prompt in requests))
+        result.cached = not any(generated for _, generated in pieces)
+        return self._assemble_symbol_tests([test_code for test_code, _ in pieces])
+
+    def _cached_symbol_tests(self, key):
+        test_code = self.response_cache.get(key)
+        if test_code is not None:
+            with self._usage_lock:
+                self.symbol_stats['cached'] += 1
+        return test_code
+
+    def _store_symbol_tests(self, key, test_code):
+        """Count a newly generated piece and cache it if it's valid Python; returns it without any code fence"""
+        test_code = self._unwrap_code_fence(test_code)
+        with self._usage_lock:
+            self.symbol_stats['generated'] += 1
+        try:
+            ast.parse(test_code)
+        except SyntaxError:
+            return test_code  # Not cached, so the next run asks again
+        self.response_cache.put(key, test_code)
+        return test_code
+
+    def _assemble_symbol_tests(self, pieces):
+        """Join per-symbol test code into one file, with each import statement once at the top"""
+        imports, bodies = [], []
+        for piece in pieces:
+            piece = self._unwrap_code_fence(piece)
+            try:
+                tree = ast.parse(piece)
+            except SyntaxError:
+                bodies.append(piece)  # Left for _validate_test_code to report
+                continue
+            lines = piece.splitlines()
+            import_lines = set()
+            for node in tree.body:
+                if isinstance(node, (ast.Import, ast.ImportFrom)):
+                    span = range(node.lineno - 1, node.end_lineno)
+                    statement = "\n".join(lines[index] for index in span)
+                    if statement not in imports:
+                        imports.append(statement)
+                    import_lines.update(span)
+            bodies.append("\n".join(line for index, line in enumerate(lines) if index not in import_lines).strip())
+        # __future__ imports must come first; sorting is stable, so the rest keep their order
+        imports.sort(key=lambda statement: not statement.startswith('from __future__'))
+        return "\n".join(imports) + "\n\n\n" + "\n\n\n".join(body for body in bodies if body) + "\n"
+
+    def _build_repo_context(self, repo):
+        """With repo_context, an overview of repo's package: every module's public classes, functions and methods"""
+        if not self.repo_context:
+            return None
+        lines = ["For context, this is the package the module to test belongs to, "
+                 "with the public API of each of its modules:"]
+        budget = self.REPO_CONTEXT_MAX_TOKENS * 4  # Characters
+        # Sorted so the overview, and with it the cached prefix, is the same for every request
+        for py_file in sorted(repo._find_python_modules()):
+            try:
+                tree = ast.parse(py_file.read_text())
+            except (SyntaxError, UnicodeDecodeError, OSError):
+                continue
+            module_lines = [f"\n# {py_file.relative_to(repo.repo_dir)}"]
+            for node in tree.body:
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not node.name.startswith('_'):
+                    module_lines.append(f"def {node.name}({ast.unparse(node.args)})")
+                elif isinstance(node, ast.ClassDef) and not node.name.startswith('_'):
+                    module_lines.append(f"class {node.name}:")
+                    module_lines += [f"    def {item.name}({ast.unparse(item.args)})" for item in node.body
+                                     if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))
+                                     and (not item.name.startswith('_') or item.name == '__init__')]
+            text = "\n".join(module_lines)
+            if len(text) > budget:
+                break
+            budget -= len(text)
+            lines.append(text)
+        return "\n".join(lines)
+
+    def _message_params(self, prompt):
+        """Messages API parameters shared by the sync and async call paths"""
+        return {
+            "model": self.MODEL,
+            "max_tokens": self.MAX_TOKENS,
+            "temperature": self.TEMPERATURE,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+        }
+
+    def _ask_claude_to_generate_tests(self, source_code, module_name):
+        """Use Claude 4 API to generate unit tests"""
+        prompt = self._build_prompt(source_code, module_name, self._repo_context)
         
         # This would be replaced with actual Claude 4 API call
         response = self._call_claude_api(prompt)
         return response
 
-    def _call_claude_api(self, prompt, max_retries=3, initial_delay=1):
+    def _concurrency_level(self):
+        """Number of requests this generator may have in flight at once"""
+        if self.concurrency_controller:
+            return self.concurrency_controller.maximum
+        return max(self.workers or 1, self.max_concurrency)
+
+    def _get_http_limits(self):
+        """Connection pool limits sized so every in-flight request can reuse a kept-alive connection"""
+        if self.http_limits is not None:
+            return self.http_limits
+        concurrency = self._concurrency_level()
+        return httpx.Limits(
+            max_connections=concurrency * 2,
+            max_keepalive_connections=concurrency,
+            keepalive_expiry=self.KEEPALIVE_EXPIRY,
+        )
+
+    def _get_http_timeout(self):
+        """Request timeouts for the Claude clients"""
+        if self.http_timeout is not None:
+            return self.http_timeout
+        return httpx.Timeout(self.REQUEST_TIMEOUT, connect=self.CONNECT_TIMEOUT)
+
+    def _get_client(self, api_key=None):
+        """Lazily create the Anthropic client shared by every sync call made with api_key"""
+        api_key = api_key or self.claude_api_key
+        with self._client_lock:
+            if api_key not in self._clients:
+                self._clients[api_key] = Anthropic(
+                    api_key=api_key,
+                    timeout=self._get_http_timeout(),
+                    max_retries=0,  # RetryPolicy owns retries, so the SDK must not multiply them
+                    http_client=httpx.Client(limits=self._get_http_limits(), timeout=self._get_http_timeout()),
+                )
+            return self._clients[api_key]
+
+    def _get_batch_client(self):
+        """The shared client with SDK retries, for the handful of batch submit and poll calls"""
+        return self._get_client().with_options(max_retries=self.BATCH_API_RETRIES)
+
+    def _get_async_client(self, api_key=None):
+        """Lazily create the AsyncAnthropic client shared by the current event loop's calls made with api_key"""
+        api_key = api_key or self.claude_api_key
+        if api_key not in self._async_clients:
+            self._async_clients[api_key] = anthropic.AsyncAnthropic(
+                api_key=api_key,
+                timeout=self._get_http_timeout(),
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=self._get_http_limits(), timeout=self._get_http_timeout()),
+            )
+        return self._async_clients[api_key]
+
+    async def _close_async_client(self):
+        """Close the async clients and their connection pools"""
+        while self._async_clients:
+            _, client = self._async_clients.popitem()
+            await client.close()
+
+    def close(self):
+        """Close the shared sync clients and their connection pools"""
+        with self._client_lock:
+            if self._hedge_executor is not None:
+                # Don't wait for losing hedged calls, their results are discarded anyway
+                self._hedge_executor.shutdown(wait=False)
+                self._hedge_executor = None
+            while self._clients:
+                _, client = self._clients.popitem()
+                client.close()
+
+    def _get_hedge_executor(self):
+        """Threads for racing hedged sync calls"""
+        with self._client_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=self._concurrency_level() * 2)
+            return self._hedge_executor
+
+    def _concurrency_slot(self):
+        """Slot from the adaptive controller around one blocking API attempt"""
+        if self.concurrency_controller:
+            return self.concurrency_controller.slot()
+        return nullcontext()
+
+    def _concurrency_slot_async(self):
+        """Slot from the adaptive controller, or else the pipeline's fixed cap, around one awaited API attempt"""
+        if self.concurrency_controller:
+            return self.concurrency_controller.slot_async()
+        if self._call_slots is not None:
+            return self._call_slots
+        return _no_slot()
+
+    def _rate_limiter_for(self, client):
+        """The rate limiter covering calls made through client: its key's own limiter in a pool, else the shared one"""
+        if self.key_pool and self.key_pool.rate_limiter(client.api_key):
+            return self.key_pool.rate_limiter(client.api_key)
+        return self.rate_limiter
+
+    def _api_key_slot(self):
+        """Key from the pool for one blocking API attempt; yields None without a pool"""
+        if self.key_pool:
+            return self._pooled_key()
+        return nullcontext()
+
+    @contextmanager
+    def _pooled_key(self):
+        key = self.key_pool.acquire()
+        try:
+            yield key.api_key
+        except BaseException as e:
+            self.key_pool.release(key, e)
+            raise
+        self.key_pool.release(key)
+
+    def _api_key_slot_async(self):
+        """Key from the pool for one awaited API attempt; yields None without a pool"""
+        if self.key_pool:
+            return self._pooled_key_async()
+        return _no_slot()
+
+    @asynccontextmanager
+    async def _pooled_key_async(self):
+        key = await self.key_pool.acquire_async()
+        try:
+            yield key.api_key
+        except BaseException as e:
+            self.key_pool.release(key, e)
+            raise
+        self.key_pool.release(key)
+
+    def _refund_output_tokens(self, client, response):
+        """Give back the part of the max_tokens reservation the response (or final stream event) didn't use"""
+        limiter = self._rate_limiter_for(client)
+        if limiter:
+            limiter.refund(self.MAX_TOKENS - response.usage.output_tokens)
+
+    def _send_request(self, client, prompt, writer=None, timeout=None):
+        """One API attempt: returns the response text, or streams it into writer when one is given"""
+        params = self._message_params(prompt)
+        if timeout is not None:
+            params['timeout'] = timeout
+        if writer is None:
+            response = client.messages.create(**params)
+            self._refund_output_tokens(client, response)
+            self._record_usage(response)
+            return response.content[0].text.strip()
+
+        # Raw events rather than the stream helper, which would accumulate the whole message in memory
+        writer.reset()
+        final_delta = input_usage = None
+        for event in client.messages.create(stream=True, **params):
+            if event.type == 'content_block_delta' and event.delta.type == 'text_delta':
+                writer.write(event.delta.text)
+            elif event.type == 'message_start':
+                input_usage = event.message.usage
+            elif event.type == 'message_delta':
+                final_delta = event  # Carries the final output token count
+        if final_delta is None:
+            raise RuntimeError("Response stream ended before the message was complete")
+        writer.finish(final_delta.usage.output_tokens)
+        self._refund_output_tokens(client, final_delta)
+        self._record_usage(final_delta, input_usage)
+
+    async def _send_request_async(self, client, prompt, writer=None, timeout=None):
+        """Async counterpart of _send_request"""
+        params = self._message_params(prompt)
+        if timeout is not None:
+            params['timeout'] = timeout
+        if writer is None:
+            response = await client.messages.create(**params)
+            self._refund_output_tokens(client, response)
+            self._record_usage(response)
+            return response.content[0].text.strip()
+
+        writer.reset()
+        final_delta = input_usage = None
+        async for event in await client.messages.create(stream=True, **params):
+            if event.type == 'content_block_delta' and event.delta.type == 'text_delta':
+                writer.write(event.delta.text)
+            elif event.type == 'message_start':
+                input_usage = event.message.usage
+            elif event.type == 'message_delta':
+                final_delta = event  # Carries the final output token count
+        if final_delta is None:
+            raise RuntimeError("Response stream ended before the message was complete")
+        writer.finish(final_delta.usage.output_tokens)
+        self._refund_output_tokens(client, final_delta)
+        self._record_usage(final_delta, input_usage)
+
+    def _timed_send(self, client, prompt, timeout=None):
+        started = time.monotonic()
+        return self._send_request(client, prompt, timeout=timeout), time.monotonic() - started
+
+    async def _timed_send_async(self, client, prompt, timeout=None):
+        started = time.monotonic()
+        return await self._send_request_async(client, prompt, timeout=timeout), time.monotonic() - started
+
+    def _claim_hedge(self, client, prompt):
+        """Claim a hedge within the policy's cap and, if rate limited, only when budget is free right now"""
+        if not self.hedge_policy.try_hedge():
+            return False
+        limiter = self._rate_limiter_for(client)
+        if limiter and not limiter.try_acquire(estimate_tokens(prompt), self.MAX_TOKENS):
+            self.hedge_policy.cancel_hedge()
+            return False
+        return True
+
+    def _send_hedged(self, client, prompt, timeout=None):
+        """Send a request and race a duplicate against it if it runs past the hedge threshold
+
+        Sync calls can't be interrupted, so a losing call finishes in the background and is dropped.
+        Streaming responses are never hedged since both copies would write the same file.
+        """
+        threshold = self.hedge_policy.start_request()
+        if threshold is None:
+            text, latency = self._timed_send(client, prompt, timeout)
+            self.hedge_policy.record(latency)
+            return text
+
+        executor = self._get_hedge_executor()
+        primary = executor.submit(self._timed_send, client, prompt, timeout)
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._claim_hedge(client, prompt):
+            text, latency = primary.result()
+            self.hedge_policy.record(latency)
+            return text
+
+        hedge = executor.submit(self._timed_send, client, prompt, timeout)
+        pending = [primary, hedge]
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                # Take the first success; a failure only counts once both copies have failed
+                if future.exception() is None or not pending:
+                    for other in pending:
+                        other.cancel()
+                    text, latency = future.result()
+                    self.hedge_policy.record(latency, hedge_won=future is hedge)
+                    return text
+
+    async def _send_hedged_async(self, client, prompt, timeout=None):
+        """Async counterpart of _send_hedged; the losing request is cancelled"""
+        threshold = self.hedge_policy.start_request()
+        primary = asyncio.ensure_future(self._timed_send_async(client, prompt, timeout))
+        try:
+            if threshold is not None:
+                done, _ = await asyncio.wait({primary}, timeout=threshold)
+                if not done and self._claim_hedge(client, prompt):
+                    return await self._race_hedge_async(client, prompt, primary, timeout)
+            text, latency = await primary
+            self.hedge_policy.record(latency)
+            return text
+        finally:
+            primary.cancel()
+
+    async def _race_hedge_async(self, client, prompt, primary, timeout=None):
+        hedge = asyncio.ensure_future(self._timed_send_async(client, prompt, timeout))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Successes first, so a failure only counts once both copies have failed
+                for task in sorted(done, key=lambda task: task.exception() is not None):
+                    if task.exception() is None or not pending:
+                        text, latency = task.result()
+                        self.hedge_policy.record(latency, hedge_won=task is hedge)
+                        return text
+        finally:
+            for task in (primary, hedge):
+                task.cancel()
+
+    def _call_claude_api(self, prompt, max_retries=3, initial_delay=1, writer=None, deadline=None):
         """Make actual API calls to Claude 4 using Anthropic client"""
-        client = Anthropic(api_key=self.claude_api_key)
-        
+        if writer is not None:
+            # A streamed response is written straight into one file, so it can't be shared
+            return self._call_with_retries(prompt, max_retries, initial_delay, writer, deadline)
+        return self.single_flight.do(
+            self._request_key(prompt),
+            lambda: self._call_with_retries(prompt, max_retries, initial_delay, deadline=deadline))
+
+    async def _call_claude_api_async(self, prompt, max_retries=3, initial_delay=1, writer=None, deadline=None):
+        """Make API calls to Claude through the shared AsyncAnthropic client"""
+        if writer is not None:
+            return await self._call_with_retries_async(prompt, max_retries, initial_delay, writer, deadline)
+        return await self.single_flight.do_async(
+            self._request_key(prompt),
+            lambda: self._call_with_retries_async(prompt, max_retries, initial_delay, deadline=deadline))
+
+    def _request_key(self, prompt):
+        """Hash of the full request parameters, identical for byte-identical modules"""
+        params = json.dumps(self._message_params(prompt), sort_keys=True)
+        return hashlib.sha256(params.encode()).hexdigest()
+
+    def _call_with_retries(self, prompt, max_retries, initial_delay, writer=None, deadline=None):
+        """One call to Claude, retried under the retry policy, circuit breaker and straggler deadlines
+
+        deadline, if given, is a monotonic time shared with the module's other calls; otherwise the call gets its own.
+        """
+
         # # Claude API parameters
         # params = {
         #     "model": "claude-2.1",  # Use a model supported by the Completions API
@@ -97,26 +2359,189 @@ class GitHubTestGenerator:
         # }
         
         # Retry logic for API calls
-        for attempt in range(max_retries):
+        self.retry_policy.start_request()
+        delay = initial_delay
+        attempt = requeues = 0
+        deadline = deadline or self._call_deadline()
+        shape = self.straggler_policy.shape(estimate_tokens(prompt)) if self.straggler_policy else None
+        while attempt < max_retries:
+            probe = straggler = None
             try:
-                response = client.messages.create(
-                    model="claude-3-haiku-20240307",  # Or another Claude 3 model available to you
-                    max_tokens=4000,
-                    temperature=0.3,
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                return response.content[0].text.strip()
-            except anthropic.APIConnectionError as e:
-                if attempt == max_retries - 1:
+                probe = self._wait_for_breaker()
+                with self._api_key_slot() as api_key:
+                    client = self._get_client(api_key)
+                    limiter = self._rate_limiter_for(client)
+                    if limiter:
+                        limiter.acquire(estimate_tokens(prompt), self.MAX_TOKENS)
+                    with self._concurrency_slot():
+                        timeout, straggler = self._attempt_timeout(shape, deadline)  # After any wait for a slot
+                        sent = time.monotonic() if shape else None
+                        if self.hedge_policy and writer is None:
+                            text = self._send_hedged(client, prompt, timeout)
+                        else:
+                            text = self._send_request(client, prompt, writer, timeout)
+                self._record_attempt(shape, sent)
+                return text
+            except (anthropic.APIConnectionError, anthropic.APIError) as e:
+                if self._requeue_straggler(e, straggler, requeues):
+                    requeues += 1
+                    continue
+                if self.key_pool and self.key_pool.can_reroute(e):
+                    continue  # The key was ejected; another one takes the request
+                if self._record_breaker(e):
+                    continue  # Wait for the breaker to close rather than fail the file
+                if not self._should_retry(e, attempt, max_retries):
                     raise
-                delay = initial_delay * (2 ** attempt)
+                delay = self.retry_policy.backoff(e, delay, initial_delay)
                 time.sleep(delay)
-            except anthropic.APIError as e:
-                print(f"Claude API error: {e}")
-                raise
+                attempt += 1
+            finally:
+                if probe is not None:
+                    self.circuit_breaker.release_probe(probe)
+
+    async def _call_with_retries_async(self, prompt, max_retries, initial_delay, writer=None, deadline=None):
+        """Async counterpart of _call_with_retries"""
+        self.retry_policy.start_request()
+        delay = initial_delay
+        attempt = requeues = 0
+        deadline = deadline or self._call_deadline()
+        shape = self.straggler_policy.shape(estimate_tokens(prompt)) if self.straggler_policy else None
+        while attempt < max_retries:
+            probe = straggler = None
+            try:
+                probe = await self._wait_for_breaker_async()
+                async with self._api_key_slot_async() as api_key:
+                    client = self._get_async_client(api_key)
+                    limiter = self._rate_limiter_for(client)
+                    if limiter:
+                        await limiter.acquire_async(estimate_tokens(prompt), self.MAX_TOKENS)
+                    async with self._concurrency_slot_async():
+                        timeout, straggler = self._attempt_timeout(shape, deadline)  # After any wait for a slot
+                        sent = time.monotonic() if shape else None
+                        if self.hedge_policy and writer is None:
+                            send = self._send_hedged_async(client, prompt, timeout)
+                        else:
+                            send = self._send_request_async(client, prompt, writer, timeout)
+                        text = await self._drainable(send)
+                self._record_attempt(shape, sent)
+                return text
+            except (anthropic.APIConnectionError, anthropic.APIError) as e:
+                if self._requeue_straggler(e, straggler, requeues):
+                    requeues += 1
+                    continue
+                if self.key_pool and self.key_pool.can_reroute(e):
+                    continue  # The key was ejected; another one takes the request
+                if self._record_breaker(e):
+                    continue  # Wait for the breaker to close rather than fail the file
+                if not self._should_retry(e, attempt, max_retries):
+                    raise
+                delay = self.retry_policy.backoff(e, delay, initial_delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+            finally:
+                if probe is not None:
+                    self.circuit_breaker.release_probe(probe)
+
+    async def _drainable(self, send):
+        """Await an API request, or a wait before one, that _cancel_sends can cut off at the drain deadline"""
+        task = asyncio.ensure_future(send)
+        self._sends.add(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise  # The caller itself was cancelled
+            raise TimeoutError("Still waiting on Claude when the drain deadline passed") from None
+        finally:
+            self._sends.discard(task)
+
+    def _cancel_sends(self):
+        for task in list(self._sends):
+            task.cancel()
+
+    def _wait_for_breaker(self):
+        """Block until the circuit breaker lets a call through; returns its probe ticket, if it is a probe"""
+        if not self.circuit_breaker:
+            return None
+        while True:
+            wait, probe = self.circuit_breaker.before_call()
+            if not wait:
+                return probe
+            if self._stop_requested.is_set():
+                time.sleep(self._drain_wait(wait))
+            else:
+                self._stop_requested.wait(wait)  # Woken by a stop, so the wait is cut to the drain deadline
+
+    async def _wait_for_breaker_async(self):
+        """Async counterpart of _wait_for_breaker"""
+        if not self.circuit_breaker:
+            return None
+        while True:
+            wait, probe = self.circuit_breaker.before_call()
+            if not wait:
+                return probe
+            await self._drainable(asyncio.sleep(self._drain_wait(wait)))
+
+    def _call_deadline(self):
+        """Monotonic time a call must finish by: the per-file timeout or the run's deadline, whichever is first"""
+        deadlines = []
+        if self.file_timeout:
+            deadlines.append(time.monotonic() + self.file_timeout)
+        if self.deadline_planner:
+            deadlines.append(self.deadline_planner.deadline)
+        return min(deadlines, default=None)
+
+    def _drain_wait(self, wait):
+        """wait, cut short by the drain deadline once a stop is requested; TimeoutError once it has passed"""
+        if self._drain_deadline is None:
+            return wait
+        remaining = self._drain_deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("The circuit breaker was still holding calls back when the drain deadline passed")
+        return min(wait, remaining)
+
+    def _attempt_timeout(self, shape, deadline):
+        """Seconds the next attempt may run: the straggler cutoff, capped by what's left of the call's deadline.
+
+        Also returns the shape a timeout counts as a straggler of, or None when the cutoff isn't what set the timeout.
+        """
+        timeout = self.straggler_policy.deadline(shape) if shape else None
+        straggler = shape if timeout is not None else None
+        if self._drain_deadline is not None:
+            deadline = self._drain_deadline if deadline is None else min(deadline, self._drain_deadline)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Ran out of time before Claude responded (per-file timeout, run deadline or stop)")
+            if timeout is None or remaining < timeout:
+                timeout, straggler = remaining, None  # Timing out now means the deadline passed, not a straggler
+        return timeout, straggler
 
+    def _record_attempt(self, shape, sent):
+        """Feed a successful attempt to the straggler latency distribution and the circuit breaker"""
+        if shape:
+            self.straggler_policy.record(shape, time.monotonic() - sent)
+        self._record_breaker()
+
+    def _requeue_straggler(self, error, straggler, requeues):
+        """True if an attempt timed out at the straggler cutoff, to be sent again straight away"""
+        if not straggler or not isinstance(error, anthropic.APITimeoutError):
+            return False
+        self.straggler_policy.record(straggler)
+        return requeues < self.straggler_policy.max_requeues
+
+    def _record_breaker(self, error=None):
+        """Feed a call's outcome to the circuit breaker; True means the call should wait for it and try again"""
+        return self.circuit_breaker is not None and self.circuit_breaker.record(error)
+
+    def _should_retry(self, error, attempt, max_retries):
+        """Decide whether a failed attempt gets another try, reporting errors that end the call"""
+        retryable = self.retry_policy.is_retryable(error)
+        if retryable and attempt < max_retries - 1 and self.retry_policy.try_retry(error):
+            return True
+        if not isinstance(error, anthropic.APIConnectionError):
+            print(f"Claude API error: {error}")
+        return False
         
     # def _call_claude_api(self, prompt):
     #     """Mock Claude 4 API call - replace with actual implementation"""
@@ -138,23 +2563,416 @@ class GitHubTestGenerator:
             import shutil
             shutil.rmtree(self.repo_dir)
             
-    def run(self):
-        """Main execution flow"""
-        if not self.clone_repository():
+    def _report(self):
+        """Print a summary of the generation run"""
+        failed = [result for result in self.results if result.error]
+        if failed:
+            print(f"Failed to generate tests for {len(failed)} of {len(self.results)} modules")
+        if self._manifest is not None:
+            print(f"Incremental: {self._incremental_summary(self)}")
+        if self._completed:
+            print(f"Resumed: {len(self._completed)} modules were already done by the interrupted run")
+        if self._stop_requested.is_set():
+            pending = sum(1 for result in self.results if not result.test_file)
+            print(f"Stopped early with {pending} modules pending; progress is in {self.JOURNAL_FILE}, "
+                  f"run again with resume=True to finish them")
+        if self.cost_budget:
+            budget = self.cost_budget
+            tokens, dollars = budget.spent()
+            limit = " and ".join(part for part in (
+                f"{budget.max_tokens} tokens" if budget.max_tokens is not None else "",
+                f"${budget.max_dollars:.2f}" if budget.max_dollars is not None else "") if part)
+            estimated_tokens, estimated_dollars = budget.estimate()
+            print(f"Cost: actual {tokens} tokens (${dollars:.4f}) against an estimated {estimated_tokens} tokens "
+                  f"(${estimated_dollars:.4f}), budget {limit}; "
+                  f"skipped {len(budget.skipped)} modules")
+        if self.deadline_planner and self.deadline_planner.skipped:
+            print(f"Deadline: skipped {len(self.deadline_planner.skipped)} of {len(self.results)} modules, "
+                  f"listed in {self.SKIPPED_FILE}")
+        if self.rate_limiter:
+            stats = self.rate_limiter.stats()
+            print(f"Rate limiter: {stats['requests']} requests waited {stats['total_wait']:.1f}s in total "
+                  f"(mean {stats['mean_wait']:.2f}s, max {stats['max_wait']:.2f}s)")
+        for stage in self.pipeline_stats.values():
+            if not stage.processed:
+                continue
+            print(f"Pipeline {stage.name}: {stage.processed} items ({stage.failed} failed), "
+                  f"{stage.throughput():.1f}/s, max queue depth {stage.max_queue_depth}")
+        streamed = [result for result in self.results if result.time_to_first_token is not None]
+        if streamed:
+            mean_ttft = sum(result.time_to_first_token for result in streamed) / len(streamed)
+            rates = [result.tokens_per_second for result in streamed if result.tokens_per_second]
+            mean_rate = sum(rates) / len(rates) if rates else 0.0
+            print(f"Streaming: mean time to first token {mean_ttft:.2f}s, mean {mean_rate:.0f} tokens/s")
+        if self.key_pool:
+            for stats in self.key_pool.stats():
+                waited = f", rate limiter waited {stats['limiter']['total_wait']:.1f}s" if stats['limiter'] else ""
+                print(f"API key {stats['key']}: {stats['requests']} requests, {stats['ejections']} ejections{waited}")
+        if self.hedge_policy:
+            stats = self.hedge_policy.stats()
+            print(f"Hedging: {stats['hedged']} of {stats['requests']} requests hedged, "
+                  f"{stats['hedge_wins']} won by the hedge")
+        stats = self.retry_policy.stats()
+        if stats['retries'] or stats['budget_exhausted']:
+            reasons = ", ".join(f"{count} x {reason}" for reason, count in stats['by_reason'].items())
+            print(f"Retries: {stats['retries']} for {stats['requests']} requests ({reasons}), "
+                  f"{stats['backoff_seconds']:.1f}s backing off, {stats['budget_exhausted']} refused by the retry budget")
+        if self.response_cache:
+            stats = self.response_cache.stats()
+            print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['bytes_stored'] / 1024:.1f} KB stored and {stats['evicted']} evicted this run "
+                  f"({stats['entries']} entries, {stats['total_bytes'] / 1024:.1f} KB in {self.response_cache.path})")
+        if self.repo_context:
+            tokens = self.prompt_cache_tokens
+            total = sum(tokens.values())
+            print(f"Prompt caching: {tokens['read']} input tokens read from the cache, {tokens['write']} written to it, "
+                  f"{tokens['uncached']} uncached ({tokens['read'] / total if total else 0:.0%} of input served from cache)")
+        if self.per_symbol:
+            stats = self.symbol_stats
+            print(f"Per-symbol tests: {stats['generated']} symbols generated, {stats['cached']} reused from the cache")
+        if self.single_flight.coalesced:
+            print(f"Coalesced {self.single_flight.coalesced} requests into identical calls already in flight")
+        if self.straggler_policy:
+            for shape, stats in self.straggler_policy.stats().items():
+                print(f"Stragglers ({shape} modules): {stats['stragglers']} of {stats['attempts']} attempts "
+                      f"({stats['rate']:.1%})")
+        if self.circuit_breaker:
+            stats = self.circuit_breaker.stats()
+            print(f"Circuit breaker: opened {stats['opened']} times, {stats['open_time']:.1f}s paused, "
+                  f"now {stats['state']}")
+        if self.concurrency_controller:
+            stats = self.concurrency_controller.stats()
+            print(f"Adaptive concurrency: {stats['current']} (peak {stats['peak']}, "
+                  f"{stats['increases']} increases, {stats['decreases']} decreases)")
+
+    def _timed_clone(self):
+        """Clone the repository, recording how long it took"""
+        started = time.monotonic()
+        cloned = self.clone_repository()
+        self.timings['clone'] = time.monotonic() - started
+        return cloned
+
+    def request_stop(self):
+        """Stop dispatching new modules and give in-flight calls DRAIN_TIMEOUT seconds to finish
+
+        The async pipeline cancels the calls still running at the deadline. In the sequential and
+        threaded modes the deadline only limits new attempts, and a request already sent runs until
+        its own timeout. Batch mode stops polling straight away.
+        """
+        if self._stop_requested.is_set():
+            return
+        self._drain_deadline = time.monotonic() + self.DRAIN_TIMEOUT
+        self._stop_requested.set()
+        if self.mode == 'batch':
+            print("Stopping: submitted batches keep running on the API and the next run collects them")
+            return
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.call_later, self.DRAIN_TIMEOUT, self._cancel_sends)
+        print(f"Stopping: finishing in-flight requests for up to {self.DRAIN_TIMEOUT:.0f}s (interrupt again to abort)")
+
+    @contextmanager
+    def _graceful_stop(self):
+        """Turn the first Ctrl-C or SIGTERM into request_stop(); a second one aborts straight away"""
+        if threading.current_thread() is not threading.main_thread():
+            yield  # Signal handlers can only be installed from the main thread
+            return
+        previous = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+
+        def handle(signum, frame):
+            if self._stop_requested.is_set():
+                raise KeyboardInterrupt
+            self.request_stop()
+
+        for signum in previous:
+            signal.signal(signum, handle)
+        try:
+            yield
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _source_hash(self, source_code):
+        return hashlib.sha256(source_code.encode()).hexdigest()
+
+    def _open_journal(self, repo):
+        """Start repo's journal; with resume=True, first replay it to skip the modules already done"""
+        repo._journal = RunJournal(repo.repo_dir / self.JOURNAL_FILE)
+        if not self.resume:
+            repo._journal.close(remove=True)  # A fresh run starts a fresh journal
+            return
+        for source, entry in repo._journal.replay().items():
+            py_file, test_file = repo.repo_dir / source, repo.repo_dir / (entry['test_file'] or '')
+            if (entry['status'] == 'done' and py_file.exists() and test_file.is_file()
+                    and self._source_hash(py_file.read_text()) == entry['hash']):
+                self._completed[str(py_file)] = test_file
+
+    def _journal_result(self, repo, result):
+        """Append the outcome of a module that has left the pipeline to its repo's journal"""
+        if repo._journal is None or str(result.source_file) in self._completed:
+            return
+        if result.test_file:
+            status = 'done'
+        elif result.skipped:
+            status = 'skipped'
+        else:
+            status = 'failed'
+        repo._journal.record(
+            source=str(result.source_file.relative_to(repo.repo_dir)),
+            status=status,
+            hash=result.source_hash,
+            test_file=str(result.test_file.relative_to(repo.repo_dir)) if result.test_file else None,
+        )
+
+    def _close_journal(self, repo, finished):
+        """Keep the journal of a run that was stopped or crashed, so resume=True can pick it up"""
+        if repo._journal is not None:
+            repo._journal.close(remove=finished and not self._stop_requested.is_set())
+
+    def _load_manifest(self, repo):
+        """With incremental=True, find the modules unchanged since the last run and drop tests of deleted ones"""
+        if not self.incremental:
+            return
+        manifest_file = repo.repo_dir / self.MANIFEST_FILE
+        repo._manifest = json.loads(manifest_file.read_text()) if manifest_file.exists() else {'commit': None, 'modules': {}}
+        changed = self._changed_paths(repo, repo._manifest['commit'])
+        for source, entry in list(repo._manifest['modules'].items()):
+            py_file, test_file = repo.repo_dir / source, repo.repo_dir / entry['test_file']
+            if not py_file.exists():
+                # Deleted, or renamed and regenerated under its new name
+                if test_file.exists():
+                    test_file.unlink()
+                repo._removed_tests.append(test_file)
+                del repo._manifest['modules'][source]
+            elif not test_file.exists():
+                continue
+            elif changed is not None and source not in changed:
+                repo._unchanged[str(py_file)] = test_file
+            elif self._source_hash(py_file.read_text()) == entry['hash']:
+                # Also catches modules an interrupted run already regenerated since the manifest's commit
+                repo._unchanged[str(py_file)] = test_file
+
+    def _incremental_summary(self, repo):
+        return (f"{len(repo.results)} modules regenerated, {len(repo._unchanged)} unchanged since the last run, "
+                f"{len(repo._removed_tests)} tests of deleted modules removed")
+
+    def _changed_paths(self, repo, commit):
+        """Paths git reports changed between commit and the working tree, or None if git can't tell"""
+        if commit is None:
+            return None
+        try:
+            git_repo = Repo(repo.repo_dir)
+            diff = git_repo.git.diff('--name-only', '--no-renames', commit)
+        except Exception:
+            return None  # Not a git checkout, or the commit is gone after a force push
+        return set(diff.splitlines())
+
+    def _head_commit(self, repo):
+        try:
+            return Repo(repo.repo_dir).head.commit.hexsha
+        except Exception:
+            return None
+
+    def _write_manifest(self, repo, finished):
+        """Record the commit and source hash behind every test, for the next incremental run
+
+        The commit only moves to HEAD once a run has been through every module. A stopped or crashed run
+        keeps the old one, so the modules it never reached are still in the next run's diff.
+        """
+        if repo._manifest is None:
+            return
+        modules = repo._manifest['modules']
+        for result in repo.results:
+            source = str(result.source_file.relative_to(repo.repo_dir))
+            if result.test_file:
+                source_hash = result.source_hash or self._source_hash(result.source_file.read_text())
+                modules[source] = {'hash': source_hash,
+                                   'test_file': str(result.test_file.relative_to(repo.repo_dir))}
+            else:
+                # Changed but not regenerated; with no entry it is regenerated next time
+                modules.pop(source, None)
+        if finished and not self._stop_requested.is_set():
+            repo._manifest['commit'] = self._head_commit(repo)
+        self._write_state(repo._manifest, repo.repo_dir / self.MANIFEST_FILE)
+
+    def _start_deadline(self, deadline):
+        """Plan the run around a deadline in seconds from now, if one is given"""
+        if deadline is None:
+            return
+        if self.mode == 'batch':
+            raise ValueError("Batch mode can't work to a deadline; batches complete on the API's schedule")
+        self.deadline_planner = DeadlinePlanner(deadline)
+
+    def run(self, deadline=None):
+        """Main execution flow; with a deadline (seconds), stop dispatching modules that wouldn't finish in time"""
+        self._start_deadline(deadline)
+        if not self._timed_clone():
             return False
         self.analyze_repository()
-        self.generate_tests()
+        started = time.monotonic()
+        finished = False
+        try:
+            with self._graceful_stop():
+                self.generate_tests()
+            finished = True
+        finally:
+            self.close()
+            self._close_journal(self, finished)
+            self._write_manifest(self, finished)
+        self.timings['generate'] = time.monotonic() - started
+        if self.deadline_planner or self.cost_budget:
+            self._write_skipped_list(self)
+        self._report()
         print(f"Unit tests generated in {self.repo_dir}/tests")
-        return True
+        return not self._stop_requested.is_set()
 
 
-if __name__ == "__main__":
-    # Example usage
-    repo_url = "https://github.com/akaf47/langchain-agent-lab"
+class MultiRepoTestGenerator(GitHubTestGenerator):
+    """Generates tests for many repositories through one shared pool of API workers"""
+
+    def __init__(self, repo_urls, claude_api_key, clone_workers=4, **options):
+        super().__init__(None, claude_api_key, **options)
+        if self.mode != 'async' or self.workers:
+            raise ValueError("Multi-repository runs share the async pipeline; use mode='async' without workers")
+        self.clone_workers = clone_workers  # Repositories cloned at the same time
+        self.repos = [GitHubTestGenerator(repo_url, claude_api_key, incremental=self.incremental)
+                      for repo_url in repo_urls]
+
+    def run(self, deadline=None):
+        """Clone every repository and generate tests for all of them in one shared pipeline"""
+        self._start_deadline(deadline)
+        started = time.monotonic()
+        finished = False
+        try:
+            with self._graceful_stop():
+                self.results = asyncio.run(self._run_pipeline(self.repos, clone_workers=self.clone_workers))
+            finished = True
+        finally:
+            self.close()
+            for repo in self.repos:
+                self._close_journal(repo, finished)
+                self._write_manifest(repo, finished)
+        self.timings['total'] = time.monotonic() - started
+        if self.deadline_planner or self.cost_budget:
+            for repo in self.repos:
+                if repo.language is not None:
+                    self._write_skipped_list(repo)
+        self._report()
+        return not self._stop_requested.is_set() and all(repo.language is not None for repo in self.repos)
+
+    def _report(self):
+        """Print per-repository timings followed by the aggregate run summary"""
+        for repo in self.repos:
+            if repo.language is None:
+                print(f"{repo.repo_url}: clone failed after {repo.timings.get('clone', 0.0):.1f}s")
+                continue
+            failed = sum(1 for result in repo.results if result.error)
+            print(f"{repo.repo_url}: {len(repo.results)} modules, {failed} failed, "
+                  f"clone {repo.timings['clone']:.1f}s, generation {repo.timings.get('generate', 0.0):.1f}s")
+            if repo._manifest is not None:
+                print(f"    {self._incremental_summary(repo)}")
+        print(f"{len(self.repos)} repositories, {len(self.results)} modules in {self.timings['total']:.1f}s")
+        super()._report()
+
+
+def cache_limits(args):
+    """ResponseCache size and age limits from the max_mb and ttl_days arguments"""
+    return {'max_bytes': int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None,
+            'ttl': args.ttl_days * 86400 if args.ttl_days is not None else None}
+
+
+def cache_main(argv):
+    """`Testotron.py cache ...`: inspect, prune or clear a response cache"""
+    parser = argparse.ArgumentParser(prog="Testotron.py cache", description="Inspect and prune a response cache")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="Show the number and size of cached responses").add_argument('path')
+    prune = commands.add_parser('prune', help="Delete expired responses, then least recently used ones")
+    prune.add_argument('path')
+    prune.add_argument('--max-mb', type=float, help="Evict least recently used responses beyond this size")
+    prune.add_argument('--ttl-days', type=float, help="Delete responses older than this")
+    commands.add_parser('clear', help="Delete every cached response").add_argument('path')
+    args = parser.parse_args(argv)
+
+    if not Path(args.path).exists():
+        parser.error(f"no cache at {args.path}")
+    cache = ResponseCache(args.path)
+    try:
+        if args.command == 'prune':
+            limits = cache_limits(args)
+            if limits['max_bytes'] is None and limits['ttl'] is None:
+                parser.error("prune needs --max-mb, --ttl-days or both")
+            print(f"Pruned {cache.prune(**limits)} responses")
+        elif args.command == 'clear':
+            print(f"Cleared {cache.clear()} responses")
+        stats = cache.stats()
+        print(f"{cache.path}: {stats['entries']} responses, {stats['total_bytes'] / 1024:.1f} KB")
+        if stats['entries']:
+            oldest = time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['oldest_access']))
+            newest = time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['newest_access']))
+            print(f"Last used between {oldest} and {newest}")
+    finally:
+        cache.close()
+
+
+def main(argv=None):
+    """Command line entry point"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['cache']:
+        return cache_main(argv[1:])
+    parser = argparse.ArgumentParser(description="Generate pytest unit tests for GitHub repositories with Claude")
+    parser.add_argument('repos', nargs='*', help="Repository URLs or paths to local mirrors")
+    parser.add_argument('--repos-file', help="File listing one repository URL or mirror path per line")
+    parser.add_argument('--clone-workers', type=int, default=4, help="Repositories cloned in parallel")
+    parser.add_argument('--max-concurrency', type=int, default=8, help="Claude requests in flight at once")
+    parser.add_argument('--deadline-minutes', type=float,
+                        help="Finish within this many minutes, skipping the modules that wouldn't fit")
+    parser.add_argument('--cache', help="SQLite file caching Claude responses across runs, so unchanged modules are free")
+    parser.add_argument('--cache-max-mb', dest='max_mb', type=float,
+                        help="Evict least recently used responses beyond this size")
+    parser.add_argument('--cache-ttl-days', dest='ttl_days', type=float,
+                        help="Ignore cached responses older than this")
+    parser.add_argument('--repo-context', action='store_true',
+                        help="Give every prompt an overview of the package, sent once and prompt-cached")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Pull an existing clone and only regenerate the modules changed since the last run")
+    parser.add_argument('--per-symbol', action='store_true',
+                        help="Generate and cache tests per function and class (needs --cache), "
+                             "so editing one symbol regenerates only its tests")
+    parser.add_argument('--resume', action='store_true',
+                        help="Replay the journal of an interrupted run and skip the modules it already finished")
+    args = parser.parse_args(argv)
+
+    repo_urls = list(args.repos)
+    if args.repos_file:
+        repo_urls += [line.strip() for line in Path(args.repos_file).read_text().splitlines() if line.strip()]
+    if not repo_urls:
+        # Example usage
+        repo_urls = ["https://github.com/akaf47/langchain-agent-lab"]
     claude_key = os.environ.get("CLAUDE_API_KEY")
-    
-    agent = GitHubTestGenerator(repo_url, claude_key)
-    if agent.run():
+    if claude_key and ',' in claude_key:
+        claude_key = [key.strip() for key in claude_key.split(',') if key.strip()]  # A pool of workspace keys
+
+    if args.per_symbol and not args.cache:
+        parser.error("--per-symbol needs --cache")
+    response_cache = None
+    if args.cache:
+        response_cache = ResponseCache(args.cache, **cache_limits(args))
+    if len(repo_urls) == 1:
+        agent = GitHubTestGenerator(repo_urls[0], claude_key, max_concurrency=args.max_concurrency,
+                                    resume=args.resume, response_cache=response_cache,
+                                    repo_context=args.repo_context, incremental=args.incremental,
+                                    per_symbol=args.per_symbol)
+    else:
+        agent = MultiRepoTestGenerator(repo_urls, claude_key, clone_workers=args.clone_workers,
+                                       max_concurrency=args.max_concurrency, resume=args.resume,
+                                       response_cache=response_cache, repo_context=args.repo_context,
+                                       incremental=args.incremental, per_symbol=args.per_symbol)
+    deadline = args.deadline_minutes * 60 if args.deadline_minutes else None
+    if agent.run(deadline=deadline):
         print("Test generation successful!")
     else:
-        print("Test generation failed")
\ No newline at end of file
+        print("Test generation failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import shutil
 import tempfile
@@ -17,8 +18,8 @@ def unique_repo_url():
     return f"https://example.com/{name}.git", name
 
 
-def repo_path_for(name):
-    return Path(tempfile.gettempdir()) / name
+def repo_path_for(url, name):
+    return Path(tempfile.gettempdir()) / f"{name}-{hashlib.sha256(url.encode()).hexdigest()[:8]}"
 
 
 def cleanup_path(p: Path):
@@ -38,7 +39,7 @@ def test_init_sets_fields():
 
 def test_clone_repository_fresh_clone_success(monkeypatch):
     repo_url, name = unique_repo_url()
-    target_dir = repo_path_for(name)
+    target_dir = repo_path_for(repo_url, name)
     cleanup_path(target_dir)
 
     calls = []
@@ -64,7 +65,7 @@ def test_clone_repository_fresh_clone_success(monkeypatch):
 
 def test_clone_repository_repo_already_exists_skips_clone(monkeypatch, capsys):
     repo_url, name = unique_repo_url()
-    target_dir = repo_path_for(name)
+    target_dir = repo_path_for(repo_url, name)
     cleanup_path(target_dir)
     target_dir.mkdir(parents=True, exist_ok=True)
 
@@ -90,7 +91,7 @@ def test_clone_repository_repo_already_exists_skips_clone(monkeypatch, capsys):
 
 def test_clone_repository_exception_returns_false(monkeypatch, capsys):
     repo_url, name = unique_repo_url()
-    target_dir = repo_path_for(name)
+    target_dir = repo_path_for(repo_url, name)
     cleanup_path(target_dir)
 
     def fake_clone_from(url, path):
@@ -169,7 +170,7 @@ def test_generate_python_tests_creates_tests_and_skips(monkeypatch):
 
     monkeypatch.setattr(GitHubTestGenerator, "_ask_claude_to_generate_tests", fake_ask)
 
-    gen._generate_python_tests()
+    gen._generate_python_tests(mode="sequential")
 
     test_dir = repo_root / "tests"
     # Only main.py and util.py should have tests generated
@@ -214,7 +215,7 @@ def test_call_claude_api_happy_path_returns_stripped(monkeypatch):
             return types.SimpleNamespace(content=[types.SimpleNamespace(text="  test content  \n")])
 
     class FakeClient:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.messages = FakeMessages()
 
     # Patch Testotron.Anthropic to our fake
@@ -246,7 +247,7 @@ def test_call_claude_api_retries_with_exponential_backoff_then_success(monkeypat
             return types.SimpleNamespace(content=[types.SimpleNamespace(text="ok")])
 
     class FakeClient:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.messages = FakeMessages()
 
     # Track sleeps
@@ -265,8 +266,8 @@ def test_call_claude_api_retries_with_exponential_backoff_then_success(monkeypat
     result = gen._call_claude_api("prompt", max_retries=3, initial_delay=2)
 
     assert result == "ok"
-    # Expect two sleeps: 2^0*2, 2^1*2 => 2, 4
-    assert delays == [2, 4]
+    # Expect two jittered sleeps, never shorter than the initial delay
+    assert len(delays) == 2 and all(d >= 2 for d in delays)
     assert call_counter["count"] == 3
 
 
@@ -288,7 +289,7 @@ def test_call_claude_api_api_error_prints_and_raises(monkeypatch, capsys):
             return will_raise_api_error(**kwargs)
 
     class FakeClient:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.messages = FakeMessages()
 
     class FakeTime:
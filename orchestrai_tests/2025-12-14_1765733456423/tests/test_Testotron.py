@@ -1,3 +1,4 @@
+import hashlib
 import sys
 import types
 import builtins
@@ -24,7 +25,7 @@ def testotron_module():
 
     # Provide a default Anthropic stub; tests will override as needed
     class AnthropicStub:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.api_key = api_key
             self.messages = types.SimpleNamespace(create=lambda **kwargs: None)
 
@@ -62,7 +63,7 @@ def test_clone_repository_skips_when_already_present(tmp_path, monkeypatch, test
 
     # Create the directory to simulate already-cloned repo
     repo_url = "https://github.com/owner/sample-repo.git"
-    expected_repo_dir = tmp_path / "sample-repo"
+    expected_repo_dir = tmp_path / f"sample-repo-{hashlib.sha256(repo_url.encode()).hexdigest()[:8]}"
     expected_repo_dir.mkdir(parents=True, exist_ok=True)
 
     # Ensure Repo.clone_from would raise if called (should not be called)
@@ -87,7 +88,7 @@ def test_clone_repository_clones_when_not_present(tmp_path, monkeypatch, testotr
     monkeypatch.setattr(mod.tempfile, "gettempdir", lambda: str(tmp_path))
 
     repo_url = "https://github.com/owner/new-repo.git"
-    expected_repo_dir = tmp_path / "new-repo"
+    expected_repo_dir = tmp_path / f"new-repo-{hashlib.sha256(repo_url.encode()).hexdigest()[:8]}"
 
     calls = []
 
@@ -196,7 +197,7 @@ def test_call_claude_api_success(monkeypatch, testotron_module):
             self.content = [MessageObj(text)]
 
     class AnthropicDummy:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.messages = types.SimpleNamespace(
                 create=lambda **kwargs: ResponseObj(" success text ")
             )
@@ -239,7 +240,7 @@ def test_call_claude_api_retries_on_connection_error_then_succeeds(monkeypatch,
         return ResponseObj("done")
 
     class AnthropicDummy:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.messages = types.SimpleNamespace(create=create_side_effect)
 
     monkeypatch.setattr(mod, "Anthropic", AnthropicDummy)
@@ -247,8 +248,8 @@ def test_call_claude_api_retries_on_connection_error_then_succeeds(monkeypatch,
     gen = mod.GitHubTestGenerator("url", "key")
     out = gen._call_claude_api("prompt", max_retries=3, initial_delay=2)
     assert out == "done"
-    # One retry -> one sleep with initial delay (2 * 2**0)
-    assert sleep_calls == [2]
+    # One retry -> one jittered sleep between the initial delay and three times it
+    assert len(sleep_calls) == 1 and 2 <= sleep_calls[0] <= 6
 
 
 def test_call_claude_api_exhausts_retries_and_raises(monkeypatch, testotron_module):
@@ -267,7 +268,7 @@ def test_call_claude_api_exhausts_retries_and_raises(monkeypatch, testotron_modu
         raise mod.anthropic.APIConnectionError("still failing")
 
     class AnthropicDummy:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.messages = types.SimpleNamespace(create=always_fail)
 
     monkeypatch.setattr(mod, "Anthropic", AnthropicDummy)
@@ -277,7 +278,7 @@ def test_call_claude_api_exhausts_retries_and_raises(monkeypatch, testotron_modu
         gen._call_claude_api("prompt", max_retries=3, initial_delay=1)
 
     # Two sleeps for 3 attempts (before final attempt)
-    assert sleep_calls == [1, 2]
+    assert len(sleep_calls) == 2 and all(d >= 1 for d in sleep_calls)
 
 
 def test_call_claude_api_apierror_is_raised(monkeypatch, testotron_module, capsys):
@@ -287,7 +288,7 @@ def test_call_claude_api_apierror_is_raised(monkeypatch, testotron_module, capsy
         raise mod.anthropic.APIError("bad request")
 
     class AnthropicDummy:
-        def __init__(self, api_key=None):
+        def __init__(self, api_key=None, **kwargs):
             self.messages = types.SimpleNamespace(create=fail_api)
 
     monkeypatch.setattr(mod, "Anthropic", AnthropicDummy)
@@ -0,0 +1,1245 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+
+import httpx
+import pytest
+
+import Testotron
+from Testotron import GitHubTestGenerator
+
+
+TEST_CODE = "import pytest\n\n\ndef test_{module}():\n    assert True\n"
+
+
+class MockAPI:
+    """Local stand-in for the Messages and Message Batches endpoints, served through httpx.MockTransport"""
+
+    def __init__(self):
+        self.requests = []  # Parsed bodies of the messages requests, in arrival order
+        self.batches = {}
+        self.batch_status = "ended"
+        self.failures = {}  # Module -> list of status codes to answer with before succeeding
+        self.key_failures = {}  # API key -> list of status codes to answer its requests with before succeeding
+        self.keys = []  # API key of each messages request, in arrival order
+        self.responses = {}  # Module -> response text, instead of TEST_CODE
+        self.delay = 0.0  # Seconds each request takes
+        self.delays = []  # Seconds the next requests take, in arrival order, before falling back to delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.timeline = []  # ('start' or 'end', request number) of each async request
+        self.prompt_cache = set()  # Text of the cache_control blocks written to the prompt cache
+        self.clock = None  # A FakeClock that sync requests move forward by their delay instead of sleeping
+        self._lock = threading.Lock()
+
+    def module(self, prompt):
+        if isinstance(prompt, list):
+            prompt = prompt[-1]['text']
+        match = re.search(r"`(\w+)` from the Python module: (\w+)", prompt)
+        if match:
+            return match.group(2), match.group(1)
+        return re.search(r"Python module: (\w+)", prompt).group(1), None
+
+    def text(self, prompt):
+        module, symbol = self.module(prompt)
+        if module in self.responses:
+            return self.responses[module]
+        return TEST_CODE.format(module=f"{module}_{symbol}" if symbol else module)
+
+    def message(self, text, usage=None):
+        return {"id": "msg_1", "type": "message", "role": "assistant", "model": "m",
+                "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None,
+                "usage": usage or {"input_tokens": 10, "output_tokens": 20}}
+
+    def usage(self, body):
+        """Usage as the API reports it: a cache_control block is read from the prompt cache if an earlier
+        response wrote it before this request arrived, and written to it otherwise"""
+        usage = {"input_tokens": 10, "output_tokens": 20}
+        block = body["messages"][0]["content"][0]
+        if isinstance(block, dict) and "cache_control" in block:
+            cached = block["text"] in self.prompt_cache
+            usage["cache_read_input_tokens" if cached else "cache_creation_input_tokens"] = 100
+        return usage
+
+    def handle(self, request, delay=0.0):
+        """Answer a request; it counts as received before the delay, and its answer is decided then too"""
+        path = request.url.path
+        if path.startswith("/v1/messages/batches"):
+            return self.handle_batch(request, path)
+        body, status, usage = self.receive(request)
+        timeout = self.timeout(request, delay)
+        (self.clock or time).sleep(delay if timeout is None else timeout)
+        if timeout is not None:
+            raise httpx.ReadTimeout("mock", request=request)
+        return self.respond(body, status, usage)
+
+    def receive(self, request):
+        body = json.loads(request.content)
+        api_key = request.headers.get("x-api-key")
+        with self._lock:
+            self.requests.append(body)
+            self.keys.append(api_key)
+            module, _ = self.module(body["messages"][0]["content"])
+            failures = self.key_failures.get(api_key) or self.failures.get(module)
+            return body, failures.pop(0) if failures else None, self.usage(body)
+
+    def respond(self, body, status, usage):
+        if status:
+            return httpx.Response(status, headers={"retry-after": "0"},
+                                  json={"type": "error", "error": {"type": "api_error", "message": "mock"}})
+        text = self.text(body["messages"][0]["content"])
+        if "cache_creation_input_tokens" in usage:
+            with self._lock:
+                self.prompt_cache.add(body["messages"][0]["content"][0]["text"])
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=self.events(text, usage))
+        return httpx.Response(200, json=self.message(text, usage))
+
+    def timeout(self, request, delay):
+        """The request's read timeout if it runs out before the response is due, else None"""
+        timeout = request.extensions.get("timeout", {}).get("read")
+        return timeout if timeout is not None and timeout < delay else None
+
+    def next_delay(self):
+        with self._lock:
+            return self.delays.pop(0) if self.delays else self.delay
+
+    def handle_sync(self, request):
+        return self.handle(request, self.next_delay())
+
+    async def handle_async(self, request):
+        if request.url.path.startswith("/v1/messages/batches"):
+            return self.handle(request)
+        delay = self.next_delay()
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            number = sum(1 for event, _ in self.timeline if event == 'start')
+            self.timeline.append(('start', number))
+        try:
+            body, status, usage = self.receive(request)
+            timeout = self.timeout(request, delay)
+            await asyncio.sleep(delay if timeout is None else timeout)
+            if timeout is not None:
+                raise httpx.ReadTimeout("mock", request=request)
+            return self.respond(body, status, usage)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.timeline.append(('end', number))
+
+    def events(self, text, usage=None):
+        message = dict(self.message("", usage), content=[])
+        events = [("message_start", {"type": "message_start", "message": message}),
+                  ("content_block_start", {"type": "content_block_start", "index": 0,
+                                           "content_block": {"type": "text", "text": ""}})]
+        events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                            "delta": {"type": "text_delta", "text": text[i:i + 7]}})
+                   for i in range(0, len(text), 7)]
+        events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                   ("message_delta", {"type": "message_delta", "usage": {"output_tokens": 20},
+                                      "delta": {"stop_reason": "end_turn", "stop_sequence": None}}),
+                   ("message_stop", {"type": "message_stop"})]
+        return "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events).encode()
+
+    def handle_batch(self, request, path):
+        if request.method == "POST":
+            batch_id = f"msgbatch_{len(self.batches)}"
+            self.batches[batch_id] = json.loads(request.content)["requests"]
+            return httpx.Response(200, json=self.batch(batch_id))
+        batch_id = path.split("/")[4]
+        if path.endswith("/results"):
+            lines = [json.dumps({"custom_id": entry["custom_id"], "result": self.batch_result(entry)})
+                     for entry in self.batches[batch_id]]
+            return httpx.Response(200, headers={"content-type": "application/x-jsonl"},
+                                  content=("\n".join(lines) + "\n").encode())
+        return httpx.Response(200, json=self.batch(batch_id))
+
+    def batch_result(self, entry):
+        module, _ = self.module(entry["params"]["messages"][0]["content"])
+        if self.failures.get(module):
+            return {"type": "errored", "error": {"type": "error", "error": {"type": "api_error", "message": "x"}}}
+        return {"type": "succeeded", "message": self.message(self.text(entry["params"]["messages"][0]["content"]))}
+
+    def batch(self, batch_id):
+        count = len(self.batches[batch_id])
+        return {"id": batch_id, "type": "message_batch", "processing_status": self.batch_status,
+                "request_counts": {"processing": 0, "succeeded": count, "errored": 0, "canceled": 0, "expired": 0},
+                "created_at": "2024-01-01T00:00:00Z", "expires_at": "2024-01-02T00:00:00Z", "ended_at": None,
+                "archived_at": None, "cancel_initiated_at": None,
+                "results_url": f"https://api.anthropic.com/v1/messages/batches/{batch_id}/results"}
+
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    api = MockAPI()
+
+    class Client(httpx.Client):
+        def __init__(self, **options):
+            super().__init__(transport=httpx.MockTransport(api.handle_sync), **options)
+
+    class AsyncClient(httpx.AsyncClient):
+        def __init__(self, **options):
+            super().__init__(transport=httpx.MockTransport(api.handle_async), **options)
+
+    monkeypatch.setattr(Testotron, "httpx", types.SimpleNamespace(
+        Client=Client, AsyncClient=AsyncClient, Limits=httpx.Limits, Timeout=httpx.Timeout))
+    # No real waiting between retries
+    monkeypatch.setattr(Testotron.RetryPolicy, "backoff", lambda self, error, previous, initial: 0)
+    return api
+
+
+@pytest.fixture
+def repo():
+    # Not under pytest's tmp_path: any path containing "test" is skipped as an existing test file
+    with tempfile.TemporaryDirectory(prefix="repo-") as directory:
+        root = Path(directory)
+        (root / "pkg").mkdir()
+        for index in range(6):
+            (root / "pkg" / f"m{index}.py").write_text(f"def f{index}(x):\n    return x + {index}\n")
+        yield root
+
+
+class FakeClock:
+    """Stands in for Testotron's time module: sleeping moves the clock instead of waiting"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(Testotron, "time", fake)
+    return fake
+
+
+def generator(repo, api_key="key", **options):
+    gen = GitHubTestGenerator("https://example.com/repo.git", api_key, **options)
+    gen.repo_dir = repo
+    gen.language = 'python'
+    gen.test_framework = 'pytest'
+    return gen
+
+
+def api_error(status, headers=None):
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "https://api.anthropic.com"))
+    return Testotron.anthropic.APIStatusError("mock", response=response, body=None)
+
+
+def estimate_cost(gen, module):
+    return gen._estimate_cost(Testotron.GenerationResult(gen.repo_dir / "pkg" / f"{module}.py"), gen)
+
+
+def written_tests(repo):
+    return sorted(path.name for path in (repo / "tests").glob("test_*.py"))
+
+
+def test_async_pipeline_writes_a_test_file_per_module(mock_api, repo):
+    gen = generator(repo)
+    results = gen.generate_tests()
+
+    assert written_tests(repo) == [f"test_m{index}.py" for index in range(6)]
+    assert all(result.error is None and result.test_file for result in results)
+    assert (repo / "tests" / "test_m3.py").read_text() == TEST_CODE.format(module="m3").strip()
+    assert len(mock_api.requests) == 6
+
+
+def test_async_pipeline_bounds_requests_in_flight(mock_api, repo):
+    mock_api.delay = 0.05
+    generator(repo, max_concurrency=2).generate_tests()
+
+    assert mock_api.max_in_flight == 2
+
+
+def test_async_pipeline_failed_module_doesnt_stop_the_others(mock_api, repo):
+    mock_api.failures["m2"] = [400]
+    results = generator(repo).generate_tests()
+
+    failed = [result for result in results if result.error]
+    assert [result.source_file.stem for result in failed] == ["m2"]
+    assert isinstance(failed[0].error, Testotron.anthropic.BadRequestError)
+    assert "test_m2.py" not in written_tests(repo)
+    assert len(written_tests(repo)) == 5
+
+
+@pytest.mark.parametrize("options", [{"mode": "sequential"}, {"mode": "sequential", "workers": 2}])
+def test_failed_module_doesnt_stop_the_others_without_the_pipeline(mock_api, repo, options, monkeypatch):
+    mock_api.failures["m2"] = [400]
+    gen = generator(repo, **options)
+    monkeypatch.setattr(gen, "_timed_clone", lambda: True)
+    monkeypatch.setattr(gen, "analyze_repository", lambda: None)
+    gen.run()
+
+    errors = {result.source_file.stem: result.error for result in gen.results}
+    assert isinstance(errors.pop("m2"), Testotron.anthropic.BadRequestError)
+    assert all(error is None for error in errors.values())
+    assert len(written_tests(repo)) == 5
+
+
+def test_async_pipeline_retries_overloaded_requests(mock_api, repo):
+    mock_api.failures["m1"] = [529, 429]
+    results = generator(repo).generate_tests()
+
+    assert all(result.error is None for result in results)
+    assert sum(1 for body in mock_api.requests if "module: m1." in body["messages"][0]["content"]) == 3
+
+
+def test_async_pipeline_streams_into_the_test_files(mock_api, repo):
+    results = generator(repo, stream=True).generate_tests()
+
+    assert all(result.error is None and result.time_to_first_token is not None for result in results)
+    assert (repo / "tests" / "test_m0.py").read_text() == TEST_CODE.format(module="m0").strip()
+    assert not list((repo / "tests").glob("*.partial"))
+
+
+def test_batch_mode_submits_every_prompt_and_maps_results_back(mock_api, repo):
+    mock_api.failures["m4"] = [500]
+    results = generator(repo, mode='batch', batch_poll_interval=0).generate_tests()
+
+    assert len(mock_api.batches) == 1
+    assert len(mock_api.batches["msgbatch_0"]) == 6
+    assert mock_api.requests == []  # Nothing went through the Messages endpoint
+    errors = {result.source_file.stem: result.error for result in results}
+    assert isinstance(errors.pop("m4"), RuntimeError)
+    assert all(error is None for error in errors.values())
+    assert written_tests(repo) == [f"test_m{index}.py" for index in range(6) if index != 4]
+    assert not (repo / GitHubTestGenerator.BATCH_STATE_FILE).exists()
+
+
+def test_batch_mode_splits_batches_at_the_request_limit(mock_api, repo, monkeypatch):
+    monkeypatch.setattr(GitHubTestGenerator, "BATCH_MAX_REQUESTS", 4)
+    generator(repo, mode='batch', batch_poll_interval=0).generate_tests()
+
+    assert sorted(len(requests) for requests in mock_api.batches.values()) == [2, 4]
+    assert len(written_tests(repo)) == 6
+
+
+def test_batch_mode_resumes_pending_batches_after_a_restart(mock_api, repo, monkeypatch):
+    crashed = generator(repo, mode='batch', batch_poll_interval=0)
+    monkeypatch.setattr(crashed, "_wait_for_batch", lambda batch_id: (_ for _ in ()).throw(KeyboardInterrupt))
+    with pytest.raises(KeyboardInterrupt):
+        crashed.generate_tests()
+    state = json.loads((repo / GitHubTestGenerator.BATCH_STATE_FILE).read_text())
+    assert [batch['id'] for batch in state['batches']] == ["msgbatch_0"]
+
+    results = generator(repo, mode='batch', batch_poll_interval=0).generate_tests()
+
+    assert list(mock_api.batches) == ["msgbatch_0"]  # Picked up, not submitted again
+    assert all(result.error is None for result in results)
+    assert len(written_tests(repo)) == 6
+    assert not (repo / GitHubTestGenerator.BATCH_STATE_FILE).exists()
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_streamed_tests_are_unwrapped_from_a_code_fence(mock_api, repo, mode):
+    mock_api.responses["m0"] = "```python\n" + TEST_CODE.format(module="m0") + "```"
+    results = generator(repo, mode=mode, stream=True).generate_tests()
+
+    assert all(result.error is None for result in results)
+    assert (repo / "tests" / "test_m0.py").read_text() == TEST_CODE.format(module="m0").strip()
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_streamed_invalid_python_is_rejected_before_it_is_committed(mock_api, repo, mode):
+    mock_api.responses["m0"] = "Sure! Here are your tests:\ndef test_m0(:\n"
+    results = generator(repo, mode=mode, stream=True).generate_tests()
+
+    errors = {result.source_file.stem: result.error for result in results}
+    assert isinstance(errors["m0"], ValueError)
+
+    assert not (repo / "tests" / "test_m0.py").exists()
+    assert not list((repo / "tests").glob("*.partial"))
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_breaker_probe_that_times_out_gives_its_slot_back(mock_api, repo, mode):
+    breaker = Testotron.CircuitBreaker(min_calls=1, open_seconds=0, probe_wait=0.01)
+    gen = generator(repo, circuit_breaker=breaker)
+    attempt_timeout = gen._attempt_timeout
+
+    def probe_runs_out_of_time(shape, deadline):
+        if breaker.state == breaker.HALF_OPEN and not timed_out:
+            timed_out.append(True)
+            raise TimeoutError("mock")
+        return attempt_timeout(shape, deadline)
+
+    timed_out = []
+    gen._attempt_timeout = probe_runs_out_of_time
+    mock_api.failures["m0"] = [500]
+    prompt = "Python module: m0."
+
+    def call():
+        if mode == "async":
+            return asyncio.run(gen._call_with_retries_async(prompt, 3, 0))
+        return gen._call_with_retries(prompt, 3, 0)
+
+    with pytest.raises(TimeoutError):
+        call()
+    assert breaker.state == breaker.HALF_OPEN and breaker._probes == 0
+
+    assert call().strip() == TEST_CODE.format(module="m0").strip()
+    assert breaker.state == breaker.CLOSED
+
+
+def test_breaker_ignores_a_probe_released_after_the_state_moved_on():
+    breaker = Testotron.CircuitBreaker(open_seconds=0)
+    breaker._open("mock")
+    _, stale = breaker.before_call()
+    breaker.record()  # The probe succeeded and closed the breaker
+    breaker._open("mock")
+    _, probe = breaker.before_call()
+
+    breaker.release_probe(stale)
+    assert breaker.before_call() == (breaker.probe_wait, None)
+    breaker.release_probe(probe)
+    assert breaker.before_call()[0] == 0
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential", "batch"])
+def test_invalid_responses_are_not_cached(mock_api, repo, mode):
+    mock_api.responses["m0"] = "Sure! Here are your tests:\ndef test_m0(:\n"
+    cache = Testotron.ResponseCache(repo / "cache.db")
+    gen = generator(repo, mode=mode, batch_poll_interval=0, response_cache=cache)
+    gen.generate_tests()
+
+    def cached(module):
+        prompt = gen._build_prompt((repo / "pkg" / f"{module}.py").read_text(), module)
+        return cache.get(gen._request_key(prompt))
+
+    assert cached("m0") is None
+    assert cached("m1").strip() == TEST_CODE.format(module="m1").strip()
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_per_symbol_pieces_are_unwrapped_and_only_cached_if_they_parse(mock_api, repo, mode):
+    (repo / "pkg" / "m0.py").write_text("import os\n\n\ndef f(x):\n    return x\n\n\ndef g(x):\n    return -x\n")
+    cache = Testotron.ResponseCache(repo / "cache.db")
+    mock_api.responses["m0"] = "```python\nimport pytest\n\n\ndef test_m0():\n    assert True\n```"
+    mock_api.responses["m1"] = "def test_m1(:\n"
+    results = generator(repo, mode='async', response_cache=cache, per_symbol=True).generate_tests()
+
+    errors = {result.source_file.stem: result.error for result in results}
+    assert errors.pop("m0") is None
+    assert isinstance(errors.pop("m1"), ValueError)
+    assert (repo / "tests" / "test_m0.py").read_text().startswith("import pytest\n\n\ndef test_m0():")
+    assert "```" not in (repo / "tests" / "test_m0.py").read_text()
+
+    del mock_api.responses["m1"]
+    requests = len(mock_api.requests)
+    gen = generator(repo, mode=mode, response_cache=cache, per_symbol=True)
+    gen.generate_tests()
+
+    # Only m1's piece was sent again: m0's two pieces and the other modules came from the cache
+    assert len(mock_api.requests) == requests + 1
+    assert gen.symbol_stats == {'cached': 6, 'generated': 1}
+
+
+def test_budget_only_run_lists_the_modules_it_skipped(mock_api, repo, monkeypatch):
+    estimate = estimate_cost(generator(repo), "m0")
+    gen = generator(repo, max_concurrency=1, cost_budget=Testotron.CostBudget(max_tokens=1.5 * sum(estimate)))
+    monkeypatch.setattr(gen, "_timed_clone", lambda: True)
+    monkeypatch.setattr(gen, "analyze_repository", lambda: None)
+    gen.run()
+
+    skipped = sorted(f"pkg/{result.source_file.name}\t{result.skipped}" for result in gen.results if result.skipped)
+    assert skipped and all(line.endswith("\tbudget") for line in skipped)
+    assert sorted((repo / GitHubTestGenerator.SKIPPED_FILE).read_text().splitlines()) == skipped
+
+
+def test_stop_cancels_async_calls_still_in_flight_at_the_drain_deadline(mock_api, repo, monkeypatch):
+    monkeypatch.setattr(GitHubTestGenerator, "DRAIN_TIMEOUT", 0.05)
+    mock_api.delay = 30
+    gen = generator(repo, max_concurrency=2)
+    threading.Timer(0.1, gen.request_stop).start()
+    results = gen.generate_tests()
+
+    attempted = [result for result in results if not result.skipped]
+    assert len(attempted) == 2
+    assert all(isinstance(result.error, TimeoutError) for result in attempted)
+    assert written_tests(repo) == []
+
+
+def test_journal_replay_keeps_the_latest_entry_per_module_and_ignores_a_torn_line(repo):
+    journal = Testotron.RunJournal(repo / "journal")
+    journal.record(source="pkg/m0.py", status="failed", hash="a", test_file=None)
+    journal.record(source="pkg/m1.py", status="done", hash="b", test_file="tests/test_m1.py")
+    journal.record(source="pkg/m0.py", status="done", hash="a", test_file="tests/test_m0.py")
+    journal.close()
+    with open(repo / "journal", "a") as handle:
+        handle.write('{"source": "pkg/m2.py", "sta')  # The crash came mid-write
+
+    entries = journal.replay()
+    assert sorted(entries) == ["pkg/m0.py", "pkg/m1.py"]
+    assert entries["pkg/m0.py"]["status"] == "done"
+    assert Testotron.RunJournal(repo / "missing").replay() == {}
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_resume_skips_the_modules_the_interrupted_run_finished_unless_they_changed(mock_api, repo, mode):
+    def source_hash(name):
+        return hashlib.sha256((repo / "pkg" / f"{name}.py").read_text().encode()).hexdigest()
+
+    (repo / "tests").mkdir()
+    for name in ("m0", "m1"):
+        (repo / "tests" / f"test_{name}.py").write_text("# From the interrupted run\n")
+    journal = Testotron.RunJournal(repo / GitHubTestGenerator.JOURNAL_FILE)
+    journal.record(source="pkg/m0.py", status="done", hash=source_hash("m0"), test_file="tests/test_m0.py")
+    journal.record(source="pkg/m1.py", status="done", hash=source_hash("m1"), test_file="tests/test_m1.py")
+    journal.record(source="pkg/m2.py", status="failed", hash=source_hash("m2"), test_file=None)
+    journal.record(source="pkg/m3.py", status="done", hash=source_hash("m3"), test_file="tests/test_m3.py")
+    journal.close()
+    (repo / "pkg" / "m1.py").write_text("def f1(x):\n    return x - 1\n")  # Edited since it was done
+
+    gen = generator(repo, mode=mode, resume=True)
+    results = gen.generate_tests()
+
+    sent = sorted(mock_api.module(body["messages"][0]["content"])[0] for body in mock_api.requests)
+    assert sent == ["m1", "m2", "m3", "m4", "m5"]  # m3's test file never made it to disk
+    assert (repo / "tests" / "test_m0.py").read_text() == "# From the interrupted run\n"
+    assert all(result.test_file for result in results)
+
+
+def test_batch_mode_rejects_resume():
+    with pytest.raises(ValueError, match="Batch mode resumes"):
+        GitHubTestGenerator("https://example.com/repo.git", "key", mode='batch', resume=True)
+
+
+@pytest.mark.parametrize("interruption", ["crash", "stop"])
+def test_incremental_run_after_an_interruption_regenerates_the_modules_it_never_reached(
+        mock_api, repo, monkeypatch, interruption):
+    def git(*args):
+        subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], cwd=repo, check=True,
+                       capture_output=True)
+
+    def run(interrupt_after=None):
+        gen = generator(repo, mode='sequential' if interruption == "crash" else 'async', max_concurrency=1,
+                        incremental=True)
+        monkeypatch.setattr(gen, "_timed_clone", lambda: True)
+        monkeypatch.setattr(gen, "analyze_repository", lambda: None)
+        requests = len(mock_api.requests)
+        if interrupt_after:
+            validate = gen._validate_test_code
+
+            def validate_then_interrupt(test_code, module_name):
+                if len(mock_api.requests) - requests == interrupt_after:
+                    if interruption == "crash":
+                        raise KeyboardInterrupt
+                    gen.request_stop()
+                return validate(test_code, module_name)
+            monkeypatch.setattr(gen, "_validate_test_code", validate_then_interrupt)
+        try:
+            gen.run()
+        except KeyboardInterrupt:
+            assert interrupt_after and interruption == "crash"
+        return [mock_api.module(body["messages"][0]["content"])[0] for body in mock_api.requests[requests:]]
+
+    git("init", "-q")
+    git("add", "pkg")
+    git("commit", "-qm", "first")
+    assert len(run()) == 6
+
+    for index in range(6):
+        (repo / "pkg" / f"m{index}.py").write_text(f"def f{index}(x):\n    return x - {index}\n")
+    git("commit", "-qam", "second")
+    reached = run(interrupt_after=2)
+    unreached = [f"m{index}" for index in range(6) if f"m{index}" not in reached]
+    assert unreached
+
+    if interruption == "stop":
+        # The modules the stopped run finished match the manifest's hashes, so they aren't sent again
+        assert sorted(run()) == unreached
+    else:
+        assert set(unreached) <= set(run())
+    assert run() == []
+
+
+def write_module(repo, name, functions):
+    (repo / "pkg" / f"{name}.py").write_text("".join(f"def g{index}(x):\n    return x * {index}\n\n\n"
+                                                     for index in range(functions)))
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 3])
+def test_per_symbol_requests_stay_within_max_concurrency(mock_api, repo, max_concurrency):
+    write_module(repo, "m0", 20)
+    mock_api.delay = 0.01
+    cache = Testotron.ResponseCache(repo / "cache.db")
+    results = generator(repo, max_concurrency=max_concurrency, response_cache=cache, per_symbol=True).generate_tests()
+
+    assert all(result.error is None for result in results)
+    assert len(mock_api.requests) == 25
+    assert mock_api.max_in_flight == max_concurrency
+
+
+def test_per_symbol_requests_wait_for_the_repo_context_to_be_primed(mock_api, repo):
+    write_module(repo, "m0", 5)
+    for index in range(1, 6):
+        (repo / "pkg" / f"m{index}.py").unlink()
+    mock_api.delay = 0.01
+    cache = Testotron.ResponseCache(repo / "cache.db")
+    generator(repo, max_concurrency=4, response_cache=cache, per_symbol=True, repo_context=True).generate_tests()
+
+    assert len(mock_api.requests) == 5
+    assert mock_api.timeline[:2] == [('start', 0), ('end', 0)]
+    assert mock_api.max_in_flight == 4
+
+
+def test_per_symbol_cost_estimate_counts_a_prompt_per_symbol(repo):
+    write_module(repo, "m0", 4)
+    whole = estimate_cost(generator(repo), "m0")
+    cache = Testotron.ResponseCache(repo / "cache.db")
+
+    per_symbol = estimate_cost(generator(repo, response_cache=cache, per_symbol=True), "m0")
+
+    assert per_symbol == (4 * whole[0], whole[1], 0, 0)
+
+
+def test_per_symbol_file_timeout_covers_the_whole_module(mock_api, repo):
+    write_module(repo, "m0", 4)
+    mock_api.delay = 0.1  # Four symbols one after another take 0.4s, longer than the module's file_timeout
+    cache = Testotron.ResponseCache(repo / "cache.db")
+    results = generator(repo, max_concurrency=1, response_cache=cache, per_symbol=True,
+                        file_timeout=0.25).generate_tests()
+
+    errors = {result.source_file.stem: result.error for result in results}
+    assert isinstance(errors.pop("m0"), TimeoutError)
+    assert all(error is None for error in errors.values())
+
+
+def test_stop_leaves_batch_polling_and_the_next_run_collects_the_batches(mock_api, repo):
+    mock_api.batch_status = "in_progress"
+    gen = generator(repo, mode='batch', batch_poll_interval=30)
+    threading.Timer(0.1, gen.request_stop).start()
+    results = gen.generate_tests()
+
+    assert all(result.skipped == 'cancelled' for result in results)
+    assert written_tests(repo) == []
+    assert (repo / GitHubTestGenerator.BATCH_STATE_FILE).exists()
+
+    mock_api.batch_status = "ended"
+    results = generator(repo, mode='batch', batch_poll_interval=0).generate_tests()
+
+    assert list(mock_api.batches) == ["msgbatch_0"]
+    assert all(result.error is None and not result.skipped for result in results)
+    assert len(written_tests(repo)) == 6
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_stop_cuts_an_open_breaker_wait_at_the_drain_deadline(mock_api, repo, mode, monkeypatch):
+    monkeypatch.setattr(GitHubTestGenerator, "DRAIN_TIMEOUT", 0.05)
+    mock_api.failures = {f"m{index}": [500] for index in range(6)}
+    breaker = Testotron.CircuitBreaker(min_calls=1, open_seconds=300)
+    gen = generator(repo, mode=mode, max_concurrency=1, circuit_breaker=breaker)
+    threading.Timer(0.1, gen.request_stop).start()
+    started = Testotron.time.monotonic()
+    if mode == "async":
+        errors = [result.error for result in gen.generate_tests() if not result.skipped]
+        assert errors and all(isinstance(error, TimeoutError) for error in errors)
+    else:
+        with pytest.raises(TimeoutError, match="drain deadline"):
+            gen._call_with_retries("Python module: m0.", 3, 0)
+
+    assert Testotron.time.monotonic() - started < 5
+
+
+def test_batch_mode_submits_only_the_modules_that_fit_the_cost_budget(mock_api, repo):
+    write_module(repo, "m0", 4)  # The most to test, so it goes in first
+    budget = Testotron.CostBudget(
+        max_tokens=sum(estimate_cost(generator(repo), "m0")) + 2.5 * sum(estimate_cost(generator(repo), "m1")))
+    results = generator(repo, mode='batch', batch_poll_interval=0, cost_budget=budget).generate_tests()
+
+    submitted = [mock_api.module(entry["params"]["messages"][0]["content"])[0]
+                 for entry in mock_api.batches["msgbatch_0"]]
+    assert len(submitted) == 3 and submitted[0] == "m0"
+    skipped = sorted(result.source_file.stem for result in results if result.skipped == 'budget')
+    assert sorted(submitted + skipped) == [f"m{index}" for index in range(6)]
+    assert sorted(written_tests(repo)) == sorted(f"test_{module}.py" for module in submitted)
+
+
+def test_cost_estimate_includes_the_repo_context_at_prompt_cache_prices(repo):
+    gen = generator(repo, repo_context=True)
+    gen._repo_context = gen._build_repo_context(gen)
+    context_tokens = Testotron.estimate_tokens(gen._repo_context)
+    input_tokens, output_tokens, _, _ = estimate_cost(generator(repo), "m0")
+
+    assert estimate_cost(gen, "m0") == (input_tokens, output_tokens, context_tokens, 0)
+    gen._context_primed = True
+    assert estimate_cost(gen, "m0") == (input_tokens, output_tokens, 0, context_tokens)
+
+    budget = Testotron.CostBudget(max_dollars=1)
+    budget.reserve(Testotron.GenerationResult(repo / "pkg" / "m0.py"), *estimate_cost(gen, "m0"))
+    tokens, dollars = budget.estimate()
+    assert tokens == input_tokens + output_tokens + context_tokens
+    assert dollars == pytest.approx(budget.dollars(input_tokens + 0.1 * context_tokens, output_tokens))
+
+
+def test_rate_limiter_refills_each_budget_per_minute(clock):
+    limiter = Testotron.RateLimiter(requests_per_minute=60, input_tokens_per_minute=6000, output_tokens_per_minute=600)
+
+    assert limiter.try_acquire(3000, 300)
+    assert limiter.try_acquire(3000, 0)
+    assert not limiter.try_acquire(1, 0)  # Input budget spent
+    clock.sleep(1)  # 100 input tokens back
+    assert limiter.try_acquire(100, 0)
+    assert not limiter.try_acquire(0, 400)  # Only 310 output tokens so far
+    clock.sleep(10)
+    assert limiter.try_acquire(0, 400)
+    assert limiter.headroom() == pytest.approx(10 / 600)
+
+
+def test_rate_limiter_waits_for_the_tightest_budget_and_records_the_wait(clock):
+    limiter = Testotron.RateLimiter(requests_per_minute=2, input_tokens_per_minute=600)
+
+    limiter.acquire(300, 0)
+    limiter.acquire(300, 0)
+    limiter.acquire(150, 0)  # Waits 30s for a request slot; the 150 input tokens are back after 15s
+
+    assert clock.now == 1030
+    assert limiter.stats() == {'requests': 3, 'total_wait': 30, 'mean_wait': 10, 'max_wait': 30}
+
+
+def test_rate_limiter_caps_a_request_larger_than_the_bucket_at_a_full_bucket(clock):
+    limiter = Testotron.RateLimiter(input_tokens_per_minute=100)
+
+    limiter.acquire(1000, 0)  # A full bucket is enough
+    assert clock.now == 1000
+    limiter.acquire(1000, 0)
+    assert clock.now == 1060
+
+
+def test_rate_limiter_refunds_unused_output_tokens_up_to_capacity(clock):
+    limiter = Testotron.RateLimiter(output_tokens_per_minute=1000)
+
+    assert limiter.try_acquire(0, 1000)
+    limiter.refund(600)
+    assert limiter.try_acquire(0, 600)
+    assert not limiter.try_acquire(0, 1)
+    limiter.refund(5000)
+    assert limiter.headroom() == 1.0
+
+
+def test_rate_limiter_async_acquire_sleeps_on_the_event_loop(clock, monkeypatch):
+    limiter = Testotron.RateLimiter(requests_per_minute=1)
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+        clock.sleep(seconds)
+    monkeypatch.setattr(Testotron.asyncio, "sleep", sleep)
+
+    async def acquire_twice():
+        await limiter.acquire_async(0, 0)
+        await limiter.acquire_async(0, 0)
+    asyncio.run(acquire_twice())
+
+    assert waits == [60.0]
+    assert limiter.stats()['max_wait'] == 60.0
+
+
+def test_key_pool_routes_to_the_key_with_the_most_headroom_per_request(clock):
+    pool = Testotron.ApiKeyPool(["key-a", "key-b"], requests_per_minute=10)
+    a, b = pool.keys
+
+    assert pool.acquire() is a
+    assert pool.acquire() is b  # a already has a request in flight
+    pool.release(a)
+    pool.release(b)
+    for _ in range(8):
+        a.rate_limiter.try_acquire(0, 0)
+    assert pool.acquire() is b
+
+
+def test_key_pool_ejects_keys_on_auth_errors_and_quota_errors(clock):
+    pool = Testotron.ApiKeyPool(["key-a", "key-b", "key-c"], eject_seconds=60, auth_eject_seconds=900)
+    a, b, c = pool.keys
+
+    pool.release(pool.acquire(), api_error(401))
+    pool.release(pool.acquire(), api_error(429, {"retry-after": "5"}))
+    pool.release(pool.acquire(), api_error(429))
+    assert [key.ejected_until - clock.now for key in pool.keys] == [900, 5, 60]
+    assert not pool.can_reroute(api_error(429))  # No healthy key left to take the request
+
+    assert pool.acquire() is b  # Waits for the first key back
+    assert clock.now == 1005
+    pool.release(b, api_error(500))  # Not about the key
+    assert b.ejections == 1 and pool.acquire() is b
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+@pytest.mark.parametrize("status", [401, 429])
+def test_key_pool_reroutes_a_rejected_request_to_another_key(mock_api, repo, mode, status):
+    mock_api.key_failures["bad-key"] = [status] * 100
+    gen = generator(repo, ["bad-key", "good-key"], mode=mode, max_concurrency=1)
+    results = gen.generate_tests()
+
+    assert all(result.error is None for result in results)
+    assert len(written_tests(repo)) == 6
+    assert mock_api.keys.count("bad-key") == 1  # Ejected after its first rejection
+    assert mock_api.keys.count("good-key") == 6
+    assert [stats['ejections'] for stats in gen.key_pool.stats()] == [1, 0]
+
+
+def test_hedge_policy_waits_for_samples_and_caps_hedged_requests():
+    policy = Testotron.HedgePolicy(percentile=0.9, max_fraction=0.25, min_samples=10)
+
+    assert policy.start_request() is None
+    for latency in range(1, 11):
+        policy.record(latency / 10)
+    assert policy.start_request() == 1.0  # The 90th percentile of ten samples is the largest
+    policy.start_request()
+    assert not policy.try_hedge()  # A first hedge would be one in three requests
+    policy.start_request()
+    assert policy.try_hedge()
+    assert not policy.try_hedge()
+    policy.cancel_hedge()
+    assert policy.stats() == {'requests': 4, 'hedged': 0, 'hedge_wins': 0}
+
+
+def hedging_generator(repo, mode, max_fraction=1.0):
+    policy = Testotron.HedgePolicy(min_samples=5, max_fraction=max_fraction)
+    for _ in range(5):
+        policy.record(0.02)
+    return generator(repo, mode=mode, hedge_policy=policy)
+
+
+def retried_call(gen, mode):
+    prompt = "Python module: m0."
+    if mode == "async":
+        return asyncio.run(gen._call_with_retries_async(prompt, 3, 0))
+    return gen._call_with_retries(prompt, 3, 0)
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_hedged_call_takes_the_first_copy_to_respond(mock_api, repo, mode):
+    mock_api.delays = [1.0, 0.0]  # The primary is stuck; the hedge answers straight away
+    gen = hedging_generator(repo, mode)
+    started = time.monotonic()
+
+    assert retried_call(gen, mode).strip() == TEST_CODE.format(module="m0").strip()
+    assert time.monotonic() - started < 0.5
+    assert len(mock_api.requests) == 2
+    assert gen.hedge_policy.stats() == {'requests': 1, 'hedged': 1, 'hedge_wins': 1}
+    if mode == "async":
+        assert ('end', 0) in mock_api.timeline  # The losing request was cancelled, not left running
+    gen.close()
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_hedges_stay_within_max_fraction(mock_api, repo, mode):
+    mock_api.delays = [0.1]
+    gen = hedging_generator(repo, mode, max_fraction=0.5)  # One request in two at most
+
+    retried_call(gen, mode)
+
+    assert len(mock_api.requests) == 1
+    assert gen.hedge_policy.stats()['hedged'] == 0
+    gen.close()
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_hedged_call_fails_only_once_both_copies_have_failed(mock_api, repo, mode):
+    mock_api.delays = [0.1, 0.2]
+    mock_api.failures["m0"] = [400]  # The primary answers first, with an error; the hedge succeeds
+    gen = hedging_generator(repo, mode)
+
+    assert retried_call(gen, mode).strip() == TEST_CODE.format(module="m0").strip()
+    assert gen.hedge_policy.stats()['hedge_wins'] == 1
+
+    gen.close()
+
+    mock_api.delays = [0.1, 0.2]
+    mock_api.failures["m0"] = [400, 400]
+    gen = hedging_generator(repo, mode)  # Fresh latency samples, so the hedge goes out before the primary fails
+    with pytest.raises(Testotron.anthropic.BadRequestError):
+        retried_call(gen, mode)
+    assert len(mock_api.requests) == 4  # A 400 isn't retried
+    assert gen.hedge_policy.stats() == {'requests': 1, 'hedged': 1, 'hedge_wins': 0}
+    gen.close()
+
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.mark.parametrize("outcome", ["result", ValueError("failed")])
+def test_single_flight_shares_one_call_and_its_outcome_between_threads(outcome):
+    flight = Testotron.SingleFlight()
+    release = threading.Event()
+    calls = []
+    outcomes = {}
+
+    def call():
+        calls.append(threading.current_thread().name)
+        release.wait()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def caller():
+        try:
+            outcomes[threading.current_thread().name] = flight.do("key", call)
+        except ValueError as e:
+            outcomes[threading.current_thread().name] = e
+
+    leader = threading.Thread(target=caller, name="leader")
+    leader.start()
+    wait_until(lambda: calls)
+    follower = threading.Thread(target=caller, name="follower")
+    follower.start()
+    wait_until(lambda: flight.coalesced == 1)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert calls == ["leader"]
+    assert outcomes == {"leader": outcome, "follower": outcome}
+    assert flight.do("key", lambda: "again") == "again"  # Nothing is left in flight to join
+
+
+def test_single_flight_async_followers_get_the_result_or_error_and_can_be_cancelled():
+    flight = Testotron.SingleFlight()
+
+    async def scenario():
+        release = asyncio.Event()
+        calls = []
+
+        async def call(outcome):
+            calls.append(outcome)
+            await release.wait()
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        leader = asyncio.create_task(flight.do_async("a", lambda: call("result")))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do_async("a", lambda: call("unused")))
+        cancelled = asyncio.create_task(flight.do_async("a", lambda: call("unused")))
+        failing_leader = asyncio.create_task(flight.do_async("b", lambda: call(ValueError("failed"))))
+        await asyncio.sleep(0)
+        failing_follower = asyncio.create_task(flight.do_async("b", lambda: call("unused")))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await leader == "result"
+        assert await follower == "result"  # The cancelled follower didn't cancel the shared call
+        assert cancelled.cancelled()
+        for task in (failing_leader, failing_follower):
+            with pytest.raises(ValueError, match="failed"):
+                await task
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+    assert flight.coalesced == 3
+
+
+def test_identical_modules_in_flight_together_share_one_request(mock_api, repo):
+    for index in range(6):
+        (repo / "pkg" / f"m{index}.py").unlink()
+    for package in ("a", "b"):
+        (repo / package).mkdir()
+        (repo / package / "m0.py").write_text("def f(x):\n    return x\n")
+    mock_api.delay = 0.05
+    gen = generator(repo)
+    results = gen.generate_tests()
+
+    assert all(result.error is None for result in results)
+    assert len(results) == 2
+    assert len(mock_api.requests) == 1
+    assert gen.single_flight.coalesced == 1
+
+
+def test_response_cache_evicts_least_recently_used_responses_down_to_evict_to(clock, tmp_path):
+    cache = Testotron.ResponseCache(tmp_path / "cache.db", max_bytes=1000)
+    for index in range(10):
+        cache.put(f"k{index}", "x" * 100)
+        clock.sleep(1)
+    assert cache.get("k0") == "x" * 100  # Now the most recently used
+    clock.sleep(1)
+    cache.put("k10", "x" * 100)
+
+    # 1100 bytes is over the limit, so the oldest accesses go until 900 (EVICT_TO) are left
+    assert cache.stats()['entries'] == 9 and cache.stats()['total_bytes'] == 900
+    assert cache.evicted == 2
+    assert cache.get("k1") is None and cache.get("k2") is None
+    assert cache.get("k0") is not None and cache.get("k3") is not None
+    cache.close()
+
+
+def test_response_cache_misses_expired_responses_and_prune_deletes_them(clock, tmp_path):
+    cache = Testotron.ResponseCache(tmp_path / "cache.db", ttl=60)
+    cache.put("old", "response")
+    clock.sleep(30)
+    cache.put("new", "response")
+    clock.sleep(31)
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "response"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.prune() == 1
+    assert cache.stats()['entries'] == 1
+    cache.close()
+
+
+def test_response_cache_migrates_a_cache_written_before_eviction(clock, tmp_path):
+    path = tmp_path / "cache.db"
+    db = sqlite3.connect(str(path))
+    db.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)")
+    db.executemany("INSERT INTO responses VALUES (?, ?, ?)", [("a", "x" * 100, 10.0), ("b", "é" * 50, 20.0)])
+    db.commit()
+    db.close()
+
+    cache = Testotron.ResponseCache(path, max_bytes=250)
+    stats = cache.stats()
+    assert (stats['entries'], stats['total_bytes']) == (2, 200)  # Sizes are in bytes, not characters
+    assert (stats['oldest_access'], stats['newest_access']) == (10.0, 20.0)
+    assert cache.get("b") == "é" * 50
+    cache.put("c", "x" * 100)
+    assert cache.get("a") is None  # The oldest migrated response was evicted first
+    assert cache.stats()['total_bytes'] == 200
+    cache.close()
+
+
+def test_cache_command_shows_prunes_and_clears_a_cache(tmp_path, capsys):
+    path = tmp_path / "cache.db"
+    cache = Testotron.ResponseCache(path)
+    for index in range(4):
+        cache.put(f"k{index}", "x" * 1024 * 300)
+    cache.close()
+
+    Testotron.main(['cache', 'stats', str(path)])
+    assert f"{path}: 4 responses, 1200.0 KB" in capsys.readouterr().out
+    Testotron.main(['cache', 'prune', str(path), '--max-mb', '0.5'])
+    assert "Pruned 3 responses" in capsys.readouterr().out
+    Testotron.main(['cache', 'clear', str(path)])
+    output = capsys.readouterr().out
+    assert "Cleared 1 responses" in output and f"{path}: 0 responses" in output
+
+    with pytest.raises(SystemExit):
+        Testotron.main(['cache', 'prune', str(path)])  # Nothing to prune to
+    with pytest.raises(SystemExit):
+        Testotron.main(['cache', 'stats', str(tmp_path / "missing.db")])
+
+
+def straggler_policy(latency):
+    policy = Testotron.StragglerPolicy(min_samples=5)
+    for _ in range(5):
+        policy.record('small', latency)  # A cutoff of three times latency for small prompts
+    return policy
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+def test_straggler_is_cancelled_and_sent_again(mock_api, repo, mode):
+    mock_api.delays = [1.0, 0.0]
+    gen = generator(repo, mode=mode, straggler_policy=straggler_policy(0.02))
+    started = time.monotonic()
+
+    assert retried_call(gen, mode).strip() == TEST_CODE.format(module="m0").strip()
+    assert time.monotonic() - started < 0.5
+    assert len(mock_api.requests) == 2
+    stats = gen.straggler_policy.stats()['small']
+    assert (stats['attempts'], stats['stragglers']) == (5 + 2, 1)
+    gen.close()
+
+
+@pytest.mark.parametrize("mode", ["async", "sequential"])
+@pytest.mark.parametrize("stragglers", [None, 1.0])
+def test_per_file_timeout_ends_a_call_without_counting_a_straggler(mock_api, repo, mode, stragglers):
+    mock_api.delay = 1.0
+    policy = straggler_policy(stragglers) if stragglers else None
+    gen = generator(repo, mode=mode, file_timeout=0.1, straggler_policy=policy)
+    started = time.monotonic()
+
+    with pytest.raises(TimeoutError):
+        retried_call(gen, mode)
+    assert time.monotonic() - started < 0.5
+    assert len(mock_api.requests) == 1  # Timed out at the file's deadline, so there's no time left to send it again
+    if policy:
+        assert policy.stats()['small']['stragglers'] == 0
+    gen.close()
+
+
+def open_slot(controller):
+    slot = controller.slot()
+    slot.__enter__()
+    return slot
+
+
+def close_slot(slot, error=None):
+    """Leave a slot as a call that succeeded, or failed with error"""
+    assert not slot.__exit__(type(error) if error else None, error, None)  # The error isn't swallowed
+
+
+def succeed(controller, clock, latency=1.0):
+    slot = open_slot(controller)
+    clock.sleep(latency)
+    close_slot(slot)
+
+
+def test_adaptive_concurrency_grows_by_one_per_window_of_successes(clock):
+    controller = Testotron.AdaptiveConcurrency(initial=4, maximum=6)
+    for _ in range(4):
+        succeed(controller, clock)
+    assert controller.current == 4  # +1/limit each, not yet a full window
+    succeed(controller, clock)
+    assert controller.current == 5
+
+    for _ in range(20):
+        succeed(controller, clock)
+    assert controller.current == 6  # Never past maximum
+    assert controller.stats()['peak'] == 6
+
+
+def test_adaptive_concurrency_halves_once_per_overload_of_the_requests_sent_under_the_old_limit(clock):
+    controller = Testotron.AdaptiveConcurrency(initial=8, minimum=2)
+    slots = [open_slot(controller) for _ in range(4)]
+    clock.sleep(1)
+
+    close_slot(slots[0], api_error(429))
+    assert controller.current == 4
+    close_slot(slots[1], api_error(529))  # Sent before the cut, so it doesn't cut again
+    close_slot(slots[2], api_error(500))  # Not an overload
+    assert controller.current == 4
+    close_slot(slots[3])
+
+    close_slot(open_slot(controller), api_error(429))  # Sent after the cut
+    assert controller.current == 2
+    close_slot(open_slot(controller), api_error(529))
+    assert controller.current == 2  # Never below minimum
+    assert controller.stats()['decreases'] == 3
+
+
+def test_adaptive_concurrency_stops_growing_while_latency_is_past_tolerance(clock):
+    controller = Testotron.AdaptiveConcurrency(initial=4, latency_tolerance=2.0)
+    succeed(controller, clock, latency=1.0)  # Sets the baseline
+    assert controller.increases == 1
+
+    succeed(controller, clock, latency=2.5)
+    assert controller.increases == 1
+    succeed(controller, clock, latency=1.0)
+    assert controller.increases == 2
+
+
+def test_deadline_run_dispatches_the_most_valuable_modules_and_lists_the_ones_that_would_not_fit(
+        mock_api, repo, clock, monkeypatch):
+    for index, functions in enumerate([1, 5, 2, 4, 3]):
+        write_module(repo, f"m{index}", functions)
+    mock_api.clock = clock
+    mock_api.delay = 10.0
+    gen = generator(repo, mode='sequential')
+    monkeypatch.setattr(gen, "_timed_clone", lambda: True)
+    monkeypatch.setattr(gen, "analyze_repository", lambda: None)
+    gen.run(deadline=35)
+
+    # After the first module, each is projected to take 12.5s (10s with the safety margin): two more fit in 35s
+    assert [mock_api.module(body["messages"][0]["content"])[0] for body in mock_api.requests] == ["m1", "m3", "m4"]
+    skipped = (repo / GitHubTestGenerator.SKIPPED_FILE).read_text().splitlines()
+    assert sorted(skipped) == [f"pkg/m{index}.py\tdeadline" for index in (0, 2, 5)]
+    # By value, and the cheaper of the two equal-value modules first: m5 is the fixture's shorter module
+    assert [result.source_file.stem for result in gen.deadline_planner.skipped] == ["m2", "m5", "m0"]
+
+
+def test_same_named_repositories_from_different_owners_get_their_own_clone(mock_api, monkeypatch):
+    urls = ["https://github.com/alice/utils.git", "https://github.com/bob/utils.git"]
+
+    def clone_from(url, path):
+        (Path(path) / "pkg").mkdir(parents=True)
+        owner = url.split('/')[-2]
+        (Path(path) / "pkg" / f"{owner}.py").write_text(f"def {owner}(x):\n    return x\n")
+
+    # Not under pytest's tmp_path, whose path contains "test"
+    with tempfile.TemporaryDirectory(prefix="clones-") as directory:
+        monkeypatch.setattr(Testotron.tempfile, "gettempdir", lambda: directory)
+        monkeypatch.setattr(Testotron, "Repo", types.SimpleNamespace(clone_from=clone_from))
+        gen = Testotron.MultiRepoTestGenerator(urls, "key")
+        assert gen.run()
+
+        alice, bob = (repo.repo_dir for repo in gen.repos)
+        assert alice != bob and alice.name.startswith("utils-") and bob.name.startswith("utils-")
+        assert written_tests(alice) == ["test_alice.py"]
+        assert written_tests(bob) == ["test_bob.py"]
+        assert len(mock_api.requests) == 2
+
+
+def test_retry_budget_is_min_budget_plus_a_share_of_first_attempts():
+    policy = Testotron.RetryPolicy(budget_ratio=0.5, min_budget=2)
+    for _ in range(4):
+        policy.start_request()
+
+    assert [policy.try_retry(api_error(529)) for _ in range(5)] == [True] * 4 + [False]
+    policy.start_request()
+    assert policy.try_retry(api_error(500))  # 2 + 0.5 * 5 allows one more
+    assert not policy.try_retry(api_error(500))
+    stats = policy.stats()
+    assert (stats['retries'], stats['budget_exhausted'], stats['by_reason']) == (5, 2, {529: 4, 500: 1})
+
+
+def test_backoff_honours_retry_after_beyond_max_delay():
+    policy = Testotron.RetryPolicy(max_delay=1.0)
+
+    assert policy.backoff(api_error(429, {"retry-after": "30"}), 1.0, 1.0) == 30
+    assert policy.backoff(api_error(529, {"retry-after-ms": "45000", "retry-after": "1"}), 1.0, 1.0) == 45
+    # An HTTP date isn't trusted; the capped jittered backoff applies
+    assert 0.5 <= policy.backoff(api_error(429, {"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"}), 10.0, 0.5) <= 1.0
+    assert 0.5 <= policy.backoff(api_error(500), 10.0, 0.5) <= 1.0
+
+
+def test_only_transient_errors_are_retryable():
+    policy = Testotron.RetryPolicy()
+    connection_error = Testotron.anthropic.APIConnectionError(request=httpx.Request("POST", "https://api.anthropic.com"))
+
+    assert policy.is_retryable(connection_error)
+    assert all(policy.is_retryable(api_error(status)) for status in (408, 409, 429, 500, 502, 503, 504, 529))
+    assert not any(policy.is_retryable(api_error(status)) for status in (400, 401, 403, 404, 413, 422))
+
+
+def test_client_errors_fail_the_module_without_a_retry(mock_api, repo):
+    mock_api.failures["m2"] = [422, 422]
+    gen = generator(repo)
+    results = gen.generate_tests()
+
+    errors = {result.source_file.stem: result.error for result in results}
+    assert isinstance(errors.pop("m2"), Testotron.anthropic.UnprocessableEntityError)
+    assert all(error is None for error in errors.values())
+    assert len(mock_api.requests) == 6
+    assert gen.retry_policy.stats()['retries'] == 0
+
+
+@pytest.mark.parametrize("options", [{}, {"mode": "sequential", "workers": 3}])
+def test_repo_context_is_written_to_the_prompt_cache_once_and_read_after(mock_api, repo, options, capsys):
+    mock_api.delay = 0.02
+    gen = generator(repo, max_concurrency=3, repo_context=True, **options)
+    gen.generate_tests()
+
+    context = mock_api.requests[0]["messages"][0]["content"][0]
+    assert context["cache_control"] == {"type": "ephemeral"} and "pkg/m5.py" in context["text"]
+    assert all(body["messages"][0]["content"][0] == context for body in mock_api.requests)
+    # Calls sent before the first one finished would each have written the context again
+    assert gen.prompt_cache_tokens == {'write': 100, 'read': 500, 'uncached': 60}
+    if not options:
+        assert mock_api.timeline[:2] == [('start', 0), ('end', 0)] and mock_api.max_in_flight == 3
+    gen._report()
+    assert ("Prompt caching: 500 input tokens read from the cache, 100 written to it, 60 uncached "
+            "(76% of input served from cache)") in capsys.readouterr().out